@@ -23,6 +23,11 @@ class KnowledgeGraph:
         self.graph = nx.MultiDiGraph()
         self.metadata = {}
         
+        # Snapshot nodes cho các truy vấn đọc nhiều, invalidate qua _version
+        self._version = 0
+        self._snapshot_version = -1
+        self._nodes_snapshot: Optional[List[Tuple[str, Dict[str, Any], str, Tuple[str, ...]]]] = None
+        
         # Load existing data
         self._load_graph()
         self._load_metadata()
@@ -35,10 +40,27 @@ class KnowledgeGraph:
             if os.path.exists(self.graph_file):
                 with open(self.graph_file, 'rb') as f:
                     self.graph = pickle.load(f)
+                self._invalidate_caches()
                 print(f"📊 Loaded graph: {self.graph.number_of_nodes()} nodes, {self.graph.number_of_edges()} edges")
         except Exception as e:
             print(f"❌ Error loading graph: {e}")
             self.graph = nx.MultiDiGraph()
+            self._invalidate_caches()
+    
+    def _invalidate_caches(self):
+        """Đánh dấu các cache dẫn xuất từ graph là cũ"""
+        self._version += 1
+    
+    def _get_nodes_snapshot(self) -> List[Tuple[str, Dict[str, Any], str, Tuple[str, ...]]]:
+        """Lấy snapshot (node_id, node_data, node_id_lower, string values lower)"""
+        if self._nodes_snapshot is None or self._snapshot_version != self._version:
+            self._nodes_snapshot = [
+                (node_id, node_data, node_id.lower(),
+                 tuple(value.lower() for value in node_data.values() if isinstance(value, str)))
+                for node_id, node_data in self.graph.nodes(data=True)
+            ]
+            self._snapshot_version = self._version
+        return self._nodes_snapshot
     
     def _save_graph(self):
         """Lưu graph vào file"""
@@ -81,6 +103,7 @@ class KnowledgeGraph:
                 node_attrs.update(properties)
             
             self.graph.add_node(entity_id, **node_attrs)
+            self._invalidate_caches()
             
             # Update metadata
             if entity_type not in self.metadata:
@@ -123,6 +146,7 @@ class KnowledgeGraph:
                 edge_attrs.update(properties)
             
             self.graph.add_edge(source, target, **edge_attrs)
+            self._invalidate_caches()
             
             self._save_graph()
             return True
@@ -213,19 +237,19 @@ class KnowledgeGraph:
         results = []
         query_lower = query.lower()
         
-        for node_id, node_data in self.graph.nodes(data=True):
+        for node_id, node_data, node_id_lower, values_lower in self._get_nodes_snapshot():
             # Filter by type if specified
             if entity_type and node_data.get("type") != entity_type:
                 continue
             
             # Search in node_id and properties
             match_score = 0
-            if query_lower in node_id.lower():
+            if query_lower in node_id_lower:
                 match_score += 2
             
             # Search in properties
-            for key, value in node_data.items():
-                if isinstance(value, str) and query_lower in value.lower():
+            for value_lower in values_lower:
+                if query_lower in value_lower:
                     match_score += 1
             
             if match_score > 0:
@@ -330,6 +354,7 @@ class KnowledgeGraph:
                 current_context = current_context[-5:]
             
             self.graph.nodes[entity_id]["recent_context"] = current_context
+            self._invalidate_caches()
             self._save_graph()
     
     def get_stats(self) -> Dict[str, Any]:
@@ -393,7 +418,7 @@ class PersonalityGraph(KnowledgeGraph):
         """Lấy tóm tắt personality"""
         summary = {}
         
-        for node_id, node_data in self.graph.nodes(data=True):
+        for node_id, node_data, _, _ in self._get_nodes_snapshot():
             if node_data.get("type") == "personality_trait":
                 trait_name = node_data.get("trait_name")
                 if trait_name:
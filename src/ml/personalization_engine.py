@@ -3,8 +3,16 @@ Machine Learning & Personalization Engine
 """
 import json
 import os
+import re
+import gzip
+import itertools
+import atexit
+import time
+import threading
+from types import MappingProxyType
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Tuple
 from collections import defaultdict, Counter
@@ -16,6 +24,189 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 import pickle
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _json_default(obj: Any) -> Any:
+    """Fallback serializer cho numpy types khi không có orjson"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize obj thành compact UTF-8 JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _record_hour(record: Dict[str, Any]) -> Optional[int]:
+    """Lấy giờ của record; chỉ parse timestamp với record cũ chưa có hour"""
+    hour = record.get("hour")
+    if hour is not None:
+        return hour
+    try:
+        return datetime.fromisoformat(record.get("timestamp", "")).hour
+    except (TypeError, ValueError):
+        return None
+
+
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    """Compile danh sách keyword thành một regex alternation (substring match)"""
+    return re.compile("|".join(map(re.escape, keywords)))
+
+
+# Topic keywords, mỗi topic được compile thành một regex alternation
+TOPIC_KEYWORDS = {
+    "technology": ["ai", "computer", "software", "code", "programming", "tech"],
+    "work": ["work", "job", "career", "meeting", "project", "deadline"],
+    "personal": ["family", "friend", "personal", "life", "relationship"],
+    "learning": ["learn", "study", "education", "course", "tutorial"],
+    "health": ["health", "exercise", "diet", "medical", "wellness"],
+    "entertainment": ["movie", "game", "music", "book", "fun"]
+}
+
+TOPIC_NAMES = tuple(TOPIC_KEYWORDS)
+
+_TOPIC_PATTERNS = [
+    (topic, _keyword_pattern(keywords))
+    for topic, keywords in TOPIC_KEYWORDS.items()
+]
+
+# Interaction type / response strategy classifiers, kiểm tra theo thứ tự ưu tiên
+_INTERACTION_TYPE_PATTERNS = [
+    ("help_request", _keyword_pattern(["help", "giúp", "hỗ trợ"])),
+    ("creation_request", _keyword_pattern(["create", "tạo", "make"])),
+    ("explanation_request", _keyword_pattern(["explain", "giải thích"]))
+]
+
+_RESPONSE_STRATEGY_PATTERNS = [
+    ("empathetic_response", _keyword_pattern(["understand", "feel", "support"])),
+    ("helpful_response", _keyword_pattern(["step", "first", "next", "finally"])),
+    ("technical_response", _keyword_pattern(["code", "function", "algorithm"]))
+]
+
+# Strategy mặc định cho _combine_strategies (read-only, copy mỗi request)
+_DEFAULT_COMBINED = MappingProxyType({
+    "response_style": "balanced",
+    "length": "medium",
+    "tone": "helpful",
+    "technical_level": "intermediate",
+    "include_examples": True,
+    "empathy_level": "medium"
+})
+_EMPTY = MappingProxyType({})
+
+# Feedback sentiment, so khớp theo token
+_WORD_RE = re.compile(r"\w+")
+_POSITIVE_FEEDBACK_WORDS = frozenset({"good", "great", "helpful", "thanks", "perfect"})
+_NEGATIVE_FEEDBACK_WORDS = frozenset({"bad", "wrong", "useless", "terrible"})
+
+
+def _top_k(counts: np.ndarray, k: int) -> np.ndarray:
+    """Indices của k count lớn nhất (giảm dần), bỏ qua count = 0"""
+    k = min(k, counts.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    idx = np.argpartition(-counts, k - 1)[:k]
+    idx = idx[np.argsort(-counts[idx], kind="stable")]
+    return idx[counts[idx] > 0]
+
+
+# RL state features, index theo bucket id
+_LENGTH_FEATURES = ("short_query", "medium_query", "long_query")
+_QUERY_FEATURES = ("", "question", "help_request", "explanation_request")
+_SENTIMENT_FEATURES = ("", "negative_mood", "positive_mood")
+_TIME_FEATURES = ("morning", "afternoon", "evening")
+
+
+
+# State = 8 bit: length(2) | query type(2) | sentiment(2) | time(2)
+NUM_STATES = 1 << 8
+
+
+def _pack_state(length_bucket: int, query_type: int, sentiment_bucket: int, time_bucket: int) -> int:
+    """Pack các bucket id thành state id (0-255)"""
+    return length_bucket | (query_type << 2) | (sentiment_bucket << 4) | (time_bucket << 6)
+
+
+def _state_name(length_bucket: int, query_type: int, sentiment_bucket: int, time_bucket: int) -> str:
+    """Tên state dạng cũ (sorted features nối bằng "_")"""
+    features = [
+        _LENGTH_FEATURES[length_bucket],
+        _QUERY_FEATURES[query_type],
+        _SENTIMENT_FEATURES[sentiment_bucket],
+        _TIME_FEATURES[time_bucket]
+    ]
+    return "_".join(sorted(feature for feature in features if feature))
+
+
+# Map tên state dạng cũ -> state id, dùng khi đọc feedback/Q-table cũ
+_LEGACY_STATE_IDS = {
+    _state_name(*buckets): _pack_state(*buckets)
+    for buckets in itertools.product(
+        range(len(_LENGTH_FEATURES)), range(len(_QUERY_FEATURES)),
+        range(len(_SENTIMENT_FEATURES)), range(len(_TIME_FEATURES))
+    )
+}
+
+
+def _td_update_loop(q: np.ndarray, visit_counts: np.ndarray, states: np.ndarray,
+                    actions: np.ndarray, rewards: np.ndarray, learning_rate: float):
+    """Terminal Q-learning update tuần tự cho cả batch"""
+    for i in range(states.size):
+        state = states[i]
+        action = actions[i]
+        q[state, action] += learning_rate * (rewards[i] - q[state, action])
+        visit_counts[state, action] += 1
+
+
+# Không dùng fastmath: kernel phải cho cùng kết quả với _td_update_vectorized
+_td_update_kernel = njit(cache=True)(_td_update_loop) if NUMBA_AVAILABLE else None
+
+
+def _td_update_vectorized(q: np.ndarray, visit_counts: np.ndarray, states: np.ndarray,
+                          actions: np.ndarray, rewards: np.ndarray, learning_rate: float):
+    """Cùng kết quả với update tuần tự: gộp các update trùng (state, action) theo đúng thứ tự"""
+    num_actions = q.shape[1]
+    keys = states * num_actions + actions
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    rewards = rewards[order].astype(np.float64)
+    
+    # k update liên tiếp: q <- (1-lr)^k * q + sum_j lr * (1-lr)^(k-1-j) * r_j
+    unique_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    groups = np.repeat(np.arange(unique_keys.size), counts)
+    remaining = np.repeat(starts + counts, counts) - np.arange(keys.size) - 1
+    decay = 1.0 - learning_rate
+    folded = np.bincount(groups, weights=learning_rate * decay ** remaining * rewards,
+                         minlength=unique_keys.size)
+    
+    rows, cols = np.divmod(unique_keys, num_actions)
+    q[rows, cols] = decay ** counts * q[rows, cols] + folded
+    np.add.at(visit_counts, (states, actions), 1)
+
+
 class ReinforcementLearningSystem:
     """Reinforcement Learning cho response optimization"""
     
@@ -23,23 +214,46 @@ class ReinforcementLearningSystem:
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
         
-        self.feedback_file = os.path.join(data_dir, "rl_feedback.json")
-        self.model_file = os.path.join(data_dir, "rl_model.pkl")
+        self.feedback_file = os.path.join(data_dir, "rl_feedback.jsonl")
+        self.legacy_feedback_file = os.path.join(data_dir, "rl_feedback.json")
+        self.model_file = os.path.join(data_dir, "rl_model.npz")
         
-        # Feedback data
-        self.feedback_data = self._load_feedback_data()
+        # Feedback log (append-only JSONL, giữ file mở với buffer lớn)
+        feedback_data = self._load_feedback_data()
+        self._feedback_fp = self._open_feedback_log()
         
         # Q-learning parameters
-        self.q_table = defaultdict(lambda: defaultdict(float))
         self.learning_rate = 0.1
         self.discount_factor = 0.9
-        self.epsilon = 0.1  # Exploration rate
+        self.epsilon = 0.1  # Exploration rate (upper bound)
+        self.exploration_c = 1.0  # GLIE: epsilon = min(epsilon, c / sqrt(N(s) + 1))
         
         # Action-reward mapping
         self.actions = [
             "detailed_response", "concise_response", "empathetic_response",
             "technical_response", "creative_response", "helpful_response"
         ]
+        self.actions_idx = {action: i for i, action in enumerate(self.actions)}
+        
+        # Q-table: hàng = state id (bit-packed), cột = action
+        # Khởi tạo lạc quan (> max reward = 1) để các action chưa thử được ưu tiên
+        self.initial_q = 1.0
+        self.q = np.full((NUM_STATES, len(self.actions)), self.initial_q, dtype=np.float32)
+        # Số lần mỗi cặp (state, action) được cập nhật
+        self.visit_counts = np.zeros((NUM_STATES, len(self.actions)), dtype=np.int32)
+        self._load_q_table(feedback_data)
+        
+        # Feedback chờ cập nhật theo batch: (state, action_idx, reward)
+        self._pending: List[Tuple[int, int, float]] = []
+        
+        # Ring buffer cho 100 feedback gần nhất; action lạ dùng id len(actions)
+        self.recent_size = 100
+        self.recent = np.zeros(self.recent_size, dtype=[("rating", "f4"), ("action", "i1"), ("reward", "f4")])
+        self.total_feedback = 0
+        for feedback in feedback_data:
+            self._record_recent(feedback["rating"], feedback["action"], feedback["reward"])
+        self.flush_every = 16
+        atexit.register(self.flush)
         
         print("🧠 Reinforcement Learning System initialized")
     
@@ -47,102 +261,194 @@ class ReinforcementLearningSystem:
         """Load feedback data"""
         try:
             if os.path.exists(self.feedback_file):
-                with open(self.feedback_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.feedback_file, 'rb') as f:
+                    return [_json_loads(line) for line in f if line.strip()]
+            
+            # Migrate từ file JSON cũ sang JSONL
+            if os.path.exists(self.legacy_feedback_file):
+                with open(self.legacy_feedback_file, 'rb') as f:
+                    feedback_data = _json_loads(f.read())
+                with open(self.feedback_file, 'wb') as f:
+                    f.writelines(self._encode_feedback(entry) for entry in feedback_data)
+                return feedback_data
         except Exception as e:
             print(f"❌ Error loading RL feedback: {e}")
         return []
     
-    def _save_feedback_data(self):
-        """Save feedback data"""
+    def _open_feedback_log(self):
+        """Mở feedback log ở chế độ append"""
+        try:
+            return open(self.feedback_file, 'ab', buffering=1 << 16)
+        except Exception as e:
+            print(f"❌ Error opening RL feedback log: {e}")
+            return None
+    
+    @staticmethod
+    def _encode_feedback(entry: Dict[str, Any]) -> bytes:
+        """Encode một feedback entry thành một dòng JSONL"""
+        return _json_dumps(entry) + b'\n'
+    
+    def _append_feedback(self, entry: Dict[str, Any]):
+        """Append feedback entry vào log"""
+        if self._feedback_fp is None:
+            return
         try:
-            with open(self.feedback_file, 'w', encoding='utf-8') as f:
-                json.dump(self.feedback_data, f, ensure_ascii=False, indent=2)
+            self._feedback_fp.write(self._encode_feedback(entry))
         except Exception as e:
             print(f"❌ Error saving RL feedback: {e}")
     
-    def _extract_state_features(self, context: Dict[str, Any]) -> str:
-        """Extract state từ context"""
-        features = []
-        
+    def _load_q_table(self, feedback_data: List[Dict[str, Any]]):
+        """Load Q-table, hoặc dựng lại từ feedback log nếu chưa có"""
+        try:
+            if os.path.exists(self.model_file):
+                with np.load(self.model_file, allow_pickle=False) as data:
+                    q_values = data["q"]
+                    visit_counts = data["visit_counts"]
+                if q_values.shape == self.q.shape and visit_counts.shape == self.visit_counts.shape:
+                    self.q[:] = q_values
+                    self.visit_counts[:] = visit_counts
+                    return
+                # Q-table khác layout hiện tại: dựng lại từ feedback log
+            if feedback_data:
+                self._replay_feedback(feedback_data)
+        except Exception as e:
+            print(f"❌ Error loading Q-table: {e}")
+    
+    def _replay_feedback(self, feedback_data: List[Dict[str, Any]]):
+        """Dựng lại Q-table từ feedback log"""
+        batch = []
+        for feedback in feedback_data:
+            action_idx = self.actions_idx.get(feedback.get("action"))
+            state = feedback.get("state")
+            if isinstance(state, str):
+                state = _LEGACY_STATE_IDS.get(state)
+            if action_idx is None or state is None:
+                continue
+            batch.append((state, action_idx, feedback["reward"]))
+        self._apply_td_batch(batch)
+    
+    def _save_q_table(self):
+        """Save Q-table"""
+        try:
+            np.savez_compressed(self.model_file, q=self.q, visit_counts=self.visit_counts)
+        except Exception as e:
+            print(f"❌ Error saving Q-table: {e}")
+    
+    def _extract_state_features(self, context: Dict[str, Any], now: datetime = None) -> int:
+        """Extract state id từ context"""
         # User input length
         user_input = context.get("user_input", "")
-        if len(user_input) < 20:
-            features.append("short_query")
-        elif len(user_input) > 100:
-            features.append("long_query")
-        else:
-            features.append("medium_query")
+        length_bucket = (len(user_input) >= 20) + (len(user_input) > 100)
         
         # Question type
         if "?" in user_input:
-            features.append("question")
-        elif any(word in user_input.lower() for word in ["help", "how", "giúp"]):
-            features.append("help_request")
-        elif any(word in user_input.lower() for word in ["explain", "giải thích"]):
-            features.append("explanation_request")
+            query_type = 1
+        else:
+            user_lower = user_input.lower()
+            if any(word in user_lower for word in ["help", "how", "giúp"]):
+                query_type = 2
+            elif any(word in user_lower for word in ["explain", "giải thích"]):
+                query_type = 3
+            else:
+                query_type = 0
         
         # Sentiment context
-        sentiment = context.get("sentiment", {})
-        if sentiment.get("overall_sentiment") == "negative":
-            features.append("negative_mood")
-        elif sentiment.get("overall_sentiment") == "positive":
-            features.append("positive_mood")
+        overall_sentiment = context.get("sentiment", {}).get("overall_sentiment")
+        sentiment_bucket = 1 if overall_sentiment == "negative" else 2 if overall_sentiment == "positive" else 0
         
         # Time context
-        hour = datetime.now().hour
-        if 6 <= hour < 12:
-            features.append("morning")
-        elif 12 <= hour < 18:
-            features.append("afternoon")
-        else:
-            features.append("evening")
+        hour = (now or datetime.now()).hour
+        time_bucket = 0 if 6 <= hour < 12 else 1 if 12 <= hour < 18 else 2
         
-        return "_".join(sorted(features))
+        return _pack_state(length_bucket, query_type, sentiment_bucket, time_bucket)
     
-    def get_best_action(self, state: str) -> str:
-        """Lấy best action cho state (epsilon-greedy)"""
-        if np.random.random() < self.epsilon:
+    def get_best_action(self, state: int) -> str:
+        """Lấy best action cho state (epsilon-greedy, epsilon giảm dần theo GLIE)"""
+        visits = int(self.visit_counts[state].sum())
+        if visits == 0:
+            return np.random.choice(self.actions)
+        
+        epsilon = min(self.epsilon, self.exploration_c / np.sqrt(visits + 1))
+        if np.random.random() < epsilon:
             # Exploration: random action
             return np.random.choice(self.actions)
-        else:
-            # Exploitation: best known action
-            state_q_values = self.q_table[state]
-            if not state_q_values:
-                return np.random.choice(self.actions)
-            return max(state_q_values.items(), key=lambda x: x[1])[0]
+        # Exploitation: best known action
+        return self.actions[int(self.q[state].argmax())]
     
-    def update_q_value(self, state: str, action: str, reward: float, next_state: str = None):
+    def update_q_value(self, state: int, action: str, reward: float, next_state: int = None):
         """Update Q-value với reward"""
-        current_q = self.q_table[state][action]
+        action_idx = self.actions_idx.get(action)
+        if action_idx is None:
+            print(f"⚠️ Unknown RL action: {action}")
+            return
         
-        if next_state:
-            next_q_values = self.q_table[next_state]
-            max_next_q = max(next_q_values.values()) if next_q_values else 0
+        current_q = float(self.q[state, action_idx])
+        
+        if next_state is not None:
+            max_next_q = float(self.q[next_state].max())
         else:
-            max_next_q = 0
+            max_next_q = 0.0
         
         # Q-learning update rule
         new_q = current_q + self.learning_rate * (
             reward + self.discount_factor * max_next_q - current_q
         )
         
-        self.q_table[state][action] = new_q
+        self.q[state, action_idx] = new_q
+        self.visit_counts[state, action_idx] += 1
+    
+    def _apply_td_batch(self, batch: List[Tuple[int, int, float]]):
+        """Áp dụng Q-learning update (terminal) cho cả batch trong một lần"""
+        if not batch:
+            return
+        rows, acts, rewards = zip(*batch)
+        rows = np.array(rows, dtype=np.intp)
+        acts = np.array(acts, dtype=np.intp)
+        rewards = np.array(rewards, dtype=np.float32)
+        
+        if NUMBA_AVAILABLE:
+            _td_update_kernel(self.q, self.visit_counts, rows, acts, rewards, np.float32(self.learning_rate))
+            return
+        
+        _td_update_vectorized(self.q, self.visit_counts, rows, acts, rewards, self.learning_rate)
+    
+    def flush(self):
+        """Áp dụng các feedback đang chờ, lưu Q-table và flush feedback log"""
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._apply_td_batch(batch)
+            self._save_q_table()
+        
+        if self._feedback_fp is not None:
+            try:
+                self._feedback_fp.flush()
+            except Exception as e:
+                print(f"❌ Error flushing RL feedback: {e}")
+    
+    def _record_recent(self, rating: float, action: str, reward: float):
+        """Ghi feedback vào ring buffer"""
+        self.recent[self.total_feedback % self.recent_size] = (
+            rating, self.actions_idx.get(action, len(self.actions)), reward
+        )
+        self.total_feedback += 1
     
     def learn_from_feedback(self, context: Dict[str, Any], action: str, 
-                          rating: float, response_text: str = ""):
+                          rating: float, response_text: str = "", now: datetime = None):
         """Học từ user feedback"""
-        state = self._extract_state_features(context)
+        now = now or datetime.now()
+        state = self._extract_state_features(context, now)
         
         # Convert rating (1-5) to reward (-1 to 1)
         reward = (rating - 3) / 2  # 1->-1, 3->0, 5->1
         
-        # Update Q-value
-        self.update_q_value(state, action, reward)
+        # Queue Q-value update
+        action_idx = self.actions_idx.get(action)
+        if action_idx is not None:
+            self._pending.append((state, action_idx, reward))
         
         # Store feedback data
         feedback_entry = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
             "state": state,
             "action": action,
             "rating": rating,
@@ -151,14 +457,17 @@ class ReinforcementLearningSystem:
             "response_text": response_text[:200]  # Truncate
         }
         
-        self.feedback_data.append(feedback_entry)
-        self._save_feedback_data()
+        self._record_recent(rating, action, reward)
+        self._append_feedback(feedback_entry)
+        
+        if len(self._pending) >= self.flush_every:
+            self.flush()
         
         print(f"🧠 RL Update: {state} -> {action} = {reward:.2f}")
     
-    def get_response_strategy(self, context: Dict[str, Any]) -> Dict[str, Any]:
+    def get_response_strategy(self, context: Dict[str, Any], now: datetime = None) -> Dict[str, Any]:
         """Lấy response strategy từ RL"""
-        state = self._extract_state_features(context)
+        state = self._extract_state_features(context, now)
         best_action = self.get_best_action(state)
         
         # Map action to strategy
@@ -201,39 +510,45 @@ class ReinforcementLearningSystem:
             }
         }
         
+        # Confidence chỉ tính trên các action đã được cập nhật, bỏ qua giá trị khởi tạo lạc quan
+        tried = self.visit_counts[state] > 0
+        confidence = float(self.q[state][tried].max()) if tried.any() else 0.0
+        
         return {
             "state": state,
             "recommended_action": best_action,
             "strategy": strategies.get(best_action, strategies["helpful_response"]),
-            "confidence": max(self.q_table[state].values()) if self.q_table[state] else 0.0
+            "confidence": confidence
         }
     
     def get_learning_stats(self) -> Dict[str, Any]:
         """Thống kê learning"""
-        total_feedback = len(self.feedback_data)
+        total_feedback = self.total_feedback
         
         if total_feedback == 0:
             return {"message": "No feedback data yet"}
         
         # Recent feedback analysis
-        recent_feedback = [f for f in self.feedback_data[-100:]]
-        avg_rating = np.mean([f["rating"] for f in recent_feedback])
+        recent = self.recent[:min(total_feedback, self.recent_size)]
+        ratings = recent["rating"]
+        action_ids = recent["action"].astype(np.intp)
+        avg_rating = float(ratings.mean())
         
-        # Action performance
-        action_performance = defaultdict(list)
-        for feedback in recent_feedback:
-            action_performance[feedback["action"]].append(feedback["rating"])
+        # Action performance (group-by action id)
+        num_actions = len(self.actions)
+        sums = np.bincount(action_ids, weights=ratings, minlength=num_actions + 1)
+        counts = np.bincount(action_ids, minlength=num_actions + 1)
         
         action_stats = {}
-        for action, ratings in action_performance.items():
-            action_stats[action] = {
-                "avg_rating": np.mean(ratings),
-                "count": len(ratings)
+        for action_idx in np.flatnonzero(counts[:num_actions]):
+            action_stats[self.actions[action_idx]] = {
+                "avg_rating": float(sums[action_idx] / counts[action_idx]),
+                "count": int(counts[action_idx])
             }
         
         # Q-table stats
-        q_table_size = len(self.q_table)
-        learned_states = sum(1 for state_actions in self.q_table.values() if state_actions)
+        q_table_size = self.q.shape[0]
+        learned_states = int(np.count_nonzero(self.visit_counts.any(axis=1)))
         
         return {
             "total_feedback": total_feedback,
@@ -251,10 +566,19 @@ class PersonalizationEngine:
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
         
+        self.state_file = os.path.join(data_dir, "personalization_state.json")
         self.user_profile_file = os.path.join(data_dir, "user_profile_ml.json")
         self.interaction_patterns_file = os.path.join(data_dir, "interaction_patterns.json")
         
+        # Delayed-write: các section dirty được gộp vào một snapshot duy nhất
+        self._dirty = set()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._flush_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # giữ thứ tự snapshot -> file giữa các lần flush
+        self.flush_delay = 0.5  # seconds
+        
         # User profile
+        self._saved_state = self._load_state()
         self.user_profile = self._load_user_profile()
         self.interaction_patterns = self._load_interaction_patterns()
         
@@ -262,9 +586,29 @@ class PersonalizationEngine:
         self.preference_classifier = None
         self.topic_clusterer = None
         self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        self.text_features_fitted = False
         
         print("🎯 Personalization Engine initialized")
     
+    def _load_state(self) -> Dict[str, Any]:
+        """Load snapshot (user profile + interaction patterns)"""
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'rb') as f:
+                    return _json_loads(f.read())
+        except Exception as e:
+            print(f"❌ Error loading personalization state: {e}")
+        return {}
+    
+    def _load_section(self, section: str, legacy_file: str) -> Any:
+        """Load một section từ snapshot, fallback về file riêng cũ"""
+        if section in self._saved_state:
+            return self._saved_state[section]
+        if os.path.exists(legacy_file):
+            with open(legacy_file, 'rb') as f:
+                return _json_loads(f.read())
+        return None
+    
     def _load_user_profile(self) -> Dict[str, Any]:
         """Load user profile"""
         default_profile = {
@@ -279,10 +623,9 @@ class PersonalizationEngine:
         }
         
         try:
-            if os.path.exists(self.user_profile_file):
-                with open(self.user_profile_file, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
-                    default_profile.update(loaded)
+            loaded = self._load_section("user_profile", self.user_profile_file)
+            if loaded:
+                default_profile.update(loaded)
         except Exception as e:
             print(f"❌ Error loading user profile: {e}")
         
@@ -290,29 +633,65 @@ class PersonalizationEngine:
     
     def _save_user_profile(self):
         """Save user profile"""
-        try:
-            with open(self.user_profile_file, 'w', encoding='utf-8') as f:
-                json.dump(self.user_profile, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"❌ Error saving user profile: {e}")
+        self._mark_dirty("user_profile")
     
-    def _load_interaction_patterns(self) -> List[Dict[str, Any]]:
-        """Load interaction patterns"""
+    def _load_interaction_patterns(self) -> Dict[str, Any]:
+        """Load interaction patterns (running aggregates)"""
+        default_patterns = {
+            "message_count": 0,
+            "avg_message_length": 0.0,
+            "topic_counts": {},
+            "hour_counts": [0] * 24
+        }
+        
         try:
-            if os.path.exists(self.interaction_patterns_file):
-                with open(self.interaction_patterns_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            loaded = self._load_section("interaction_patterns", self.interaction_patterns_file)
+            if isinstance(loaded, dict):
+                default_patterns.update(loaded)
         except Exception as e:
             print(f"❌ Error loading interaction patterns: {e}")
-        return []
+        
+        return default_patterns
     
     def _save_interaction_patterns(self):
         """Save interaction patterns"""
-        try:
-            with open(self.interaction_patterns_file, 'w', encoding='utf-8') as f:
-                json.dump(self.interaction_patterns, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"❌ Error saving interaction patterns: {e}")
+        self._mark_dirty("interaction_patterns")
+    
+    def _mark_dirty(self, section: str):
+        """Đánh dấu section cần lưu và hẹn giờ flush"""
+        with self._flush_lock:
+            self._dirty.add(section)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def flush(self):
+        """Ghi snapshot (atomic qua os.replace) nếu có section dirty"""
+        with self._write_lock:
+            # Snapshot dưới _flush_lock, ghi file ngoài lock để không chặn _mark_dirty
+            with self._flush_lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                dirty, self._dirty = self._dirty, set()
+            
+            try:
+                data = _json_dumps({
+                    "user_profile": self.user_profile,
+                    "interaction_patterns": self.interaction_patterns
+                })
+                tmp_file = self.state_file + ".tmp"
+                with open(tmp_file, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_file, self.state_file)
+            except Exception as e:
+                print(f"❌ Error saving personalization state: {e}")
+                # Không mất save: đánh dấu dirty lại để timer thử ghi lần sau
+                for section in dirty:
+                    self._mark_dirty(section)
     
     def analyze_user_behavior(self, conversations: List[Dict[str, Any]]):
         """Phân tích user behavior từ conversations"""
@@ -330,7 +709,6 @@ class PersonalizationEngine:
         
         for conv in conversations:
             user_input = conv.get("user_input", "")
-            timestamp = conv.get("timestamp", "")
             feedback = conv.get("feedback", "")
             
             # Message length pattern
@@ -350,11 +728,9 @@ class PersonalizationEngine:
             patterns["topics"].extend(topics)
             
             # Interaction time
-            try:
-                dt = datetime.fromisoformat(timestamp)
-                patterns["interaction_times"].append(dt.hour)
-            except:
-                pass
+            hour = _record_hour(conv)
+            if hour is not None:
+                patterns["interaction_times"].append(hour)
             
             # Satisfaction from feedback
             if feedback:
@@ -366,23 +742,8 @@ class PersonalizationEngine:
     
     def _extract_topics(self, text: str) -> List[str]:
         """Extract topics từ text"""
-        topic_keywords = {
-            "technology": ["ai", "computer", "software", "code", "programming", "tech"],
-            "work": ["work", "job", "career", "meeting", "project", "deadline"],
-            "personal": ["family", "friend", "personal", "life", "relationship"],
-            "learning": ["learn", "study", "education", "course", "tutorial"],
-            "health": ["health", "exercise", "diet", "medical", "wellness"],
-            "entertainment": ["movie", "game", "music", "book", "fun"]
-        }
-        
-        topics = []
         text_lower = text.lower()
-        
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                topics.append(topic)
-        
-        return topics
+        return [topic for topic, pattern in _TOPIC_PATTERNS if pattern.search(text_lower)]
     
     def _estimate_satisfaction(self, feedback: str) -> float:
         """Estimate satisfaction từ feedback text"""
@@ -402,9 +763,25 @@ class PersonalizationEngine:
             return 0.5
     
     def _update_profile_from_patterns(self, patterns: Dict[str, List]):
-        """Update user profile từ patterns"""
+        """Update user profile từ patterns (cộng dồn vào running aggregates)"""
+        stats = self.interaction_patterns
+        
+        # Running mean (Welford) của message length
+        for length in patterns["message_lengths"]:
+            stats["message_count"] += 1
+            stats["avg_message_length"] += (length - stats["avg_message_length"]) / stats["message_count"]
+        
+        topic_totals = stats["topic_counts"]
+        for topic in patterns["topics"]:
+            topic_totals[topic] = topic_totals.get(topic, 0) + 1
+        topic_counts = np.array([topic_totals.get(topic, 0) for topic in TOPIC_NAMES], dtype=np.int64)
+        
+        for hour in patterns["interaction_times"]:
+            stats["hour_counts"][hour] += 1
+        hour_counts = np.array(stats["hour_counts"], dtype=np.int64)
+        
         # Communication style from message length
-        avg_length = np.mean(patterns["message_lengths"]) if patterns["message_lengths"] else 10
+        avg_length = stats["avg_message_length"] if stats["message_count"] else 10
         if avg_length < 5:
             self.user_profile["communication_style"] = "concise"
         elif avg_length > 20:
@@ -413,21 +790,20 @@ class PersonalizationEngine:
             self.user_profile["communication_style"] = "balanced"
         
         # Preferred topics
-        if patterns["topics"]:
-            topic_counts = Counter(patterns["topics"])
+        total_topics = int(topic_counts.sum())
+        if total_topics:
             self.user_profile["preferred_topics"] = [
-                topic for topic, count in topic_counts.most_common(5)
+                TOPIC_NAMES[i] for i in _top_k(topic_counts, 5)
             ]
         
         # Interaction times
-        if patterns["interaction_times"]:
-            common_hours = Counter(patterns["interaction_times"])
+        if hour_counts.any():
             self.user_profile["interaction_times"] = [
-                hour for hour, count in common_hours.most_common(3)
+                int(hour) for hour in _top_k(hour_counts, 3)
             ]
         
         # Technical level from topic analysis
-        tech_ratio = patterns["topics"].count("technology") / len(patterns["topics"]) if patterns["topics"] else 0
+        tech_ratio = topic_totals.get("technology", 0) / total_topics if total_topics else 0
         if tech_ratio > 0.3:
             self.user_profile["technical_level"] = "advanced"
         elif tech_ratio > 0.1:
@@ -436,6 +812,7 @@ class PersonalizationEngine:
             self.user_profile["technical_level"] = "basic"
         
         self._save_user_profile()
+        self._save_interaction_patterns()
     
     def get_personalized_recommendations(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Đưa ra recommendations dựa trên personalization"""
@@ -493,25 +870,19 @@ class PersonalizationEngine:
         
         try:
             # Prepare features và labels
-            features = []
-            labels = []
-            
-            for data in training_data:
-                # Feature extraction
-                feature_vector = self._extract_feature_vector(data)
-                features.append(feature_vector)
-                
-                # Label (satisfaction level)
-                satisfaction = data.get("satisfaction", 0.5)
-                labels.append(1 if satisfaction > 0.6 else 0)
+            X = self._build_feature_matrix(training_data)
+            y = np.array([
+                1 if data.get("satisfaction", 0.5) > 0.6 else 0
+                for data in training_data
+            ])
             
             # Train classifier
-            X = np.array(features)
-            y = np.array(labels)
             
             X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
             
-            self.preference_classifier = RandomForestClassifier(n_estimators=100, random_state=42)
+            self.preference_classifier = RandomForestClassifier(
+                n_estimators=64, max_depth=8, n_jobs=-1, random_state=42
+            )
             self.preference_classifier.fit(X_train, y_train)
             
             # Evaluate
@@ -520,47 +891,41 @@ class PersonalizationEngine:
             
             print(f"✅ Preference model trained. Accuracy: {accuracy:.2f}")
             
-            # Save model
-            model_path = os.path.join(self.data_dir, "preference_model.pkl")
-            with open(model_path, 'wb') as f:
-                pickle.dump(self.preference_classifier, f)
+            # Save model cùng vectorizer đã fit (None nếu chỉ dùng [length, hour]) để
+            # featurize được input mới; sklearn cần pickle, gzip level 1 để giảm I/O
+            model_path = os.path.join(self.data_dir, "preference_model.pkl.gz")
+            with gzip.open(model_path, 'wb', compresslevel=1) as f:
+                pickle.dump({
+                    "vectorizer": self.vectorizer if self.text_features_fitted else None,
+                    "classifier": self.preference_classifier
+                }, f)
                 
         except Exception as e:
             print(f"❌ Model training error: {e}")
     
-    def _extract_feature_vector(self, data: Dict[str, Any]) -> List[float]:
-        """Extract feature vector cho ML model"""
-        features = []
-        
-        # Text length feature
-        text_length = len(data.get("user_input", ""))
-        features.append(text_length / 100)  # Normalize
-        
-        # Time feature
+    def _build_feature_matrix(self, training_data: List[Dict[str, Any]]) -> sparse.csr_matrix:
+        """Build feature matrix cho ML model: TF-IDF của user_input + [length, hour]"""
+        texts = [data.get("user_input", "") for data in training_data]
         try:
-            timestamp = data.get("timestamp", "")
-            dt = datetime.fromisoformat(timestamp)
-            features.append(dt.hour / 24)  # Normalize to 0-1
-        except:
-            features.append(0.5)  # Default
-        
-        # Topic features (one-hot encoding)
-        topics = ["technology", "work", "personal", "learning", "health", "entertainment"]
-        user_text = data.get("user_input", "").lower()
-        for topic in topics:
-            topic_keywords = {
-                "technology": ["ai", "computer", "code"],
-                "work": ["work", "job", "meeting"],
-                "personal": ["family", "friend", "life"],
-                "learning": ["learn", "study", "education"],
-                "health": ["health", "exercise", "medical"],
-                "entertainment": ["movie", "game", "music"]
-            }
+            text_features = self.vectorizer.fit_transform(texts)
+            self.text_features_fitted = True
+        except ValueError:
+            # Empty vocabulary (text rỗng hoặc toàn stop words): chỉ dùng [length, hour]
+            text_features = None
+            self.text_features_fitted = False
+        
+        dense_features = np.empty((len(training_data), 2), dtype=np.float64)
+        for i, data in enumerate(training_data):
+            # Text length feature
+            dense_features[i, 0] = len(texts[i]) / 100  # Normalize
             
-            has_topic = any(keyword in user_text for keyword in topic_keywords.get(topic, []))
-            features.append(1.0 if has_topic else 0.0)
+            # Time feature
+            hour = _record_hour(data)
+            dense_features[i, 1] = hour / 24 if hour is not None else 0.5  # Normalize to 0-1
         
-        return features
+        if text_features is None:
+            return sparse.csr_matrix(dense_features)
+        return sparse.hstack([sparse.csr_matrix(dense_features), text_features], format="csr")
 
 class BehaviorPredictor:
     """Predict user behavior patterns"""
@@ -570,67 +935,78 @@ class BehaviorPredictor:
         self.model_file = os.path.join(data_dir, "behavior_model.pkl")
         
         self.behavior_model = None
-        self.behavior_patterns = defaultdict(list)
+        
+        # Histogram theo giờ/ngày, mỗi behavior type là một hàng (behavior id)
+        self.behavior_ids: Dict[str, int] = {}
+        self.behavior_types: List[str] = []
+        self.hour_hist = np.zeros((8, 24), dtype=np.int32)
+        self.day_hist = np.zeros((8, 7), dtype=np.int32)
+        self.n = np.zeros(8, dtype=np.int32)
         
         print("🔮 Behavior Predictor initialized")
     
-    def record_behavior(self, behavior_type: str, context: Dict[str, Any]):
+    def record_behavior(self, behavior_type: str, context: Dict[str, Any], now: datetime = None):
         """Record user behavior"""
-        behavior_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "behavior_type": behavior_type,
-            "context": context,
-            "hour": datetime.now().hour,
-            "day_of_week": datetime.now().weekday()
-        }
+        now = now or datetime.now()
+        
+        behavior_id = self.behavior_ids.get(behavior_type)
+        if behavior_id is None:
+            behavior_id = self._add_behavior_type(behavior_type)
         
-        self.behavior_patterns[behavior_type].append(behavior_entry)
+        self.hour_hist[behavior_id, now.hour] += 1
+        self.day_hist[behavior_id, now.weekday()] += 1
+        self.n[behavior_id] += 1
+    
+    def _add_behavior_type(self, behavior_type: str) -> int:
+        """Cấp behavior id mới, tăng gấp đôi số hàng khi đầy"""
+        behavior_id = len(self.behavior_types)
+        if behavior_id >= self.n.shape[0]:
+            rows = self.n.shape[0] * 2
+            self.hour_hist = np.vstack([self.hour_hist, np.zeros_like(self.hour_hist)])
+            self.day_hist = np.vstack([self.day_hist, np.zeros_like(self.day_hist)])
+            self.n = np.concatenate([self.n, np.zeros(rows - self.n.shape[0], dtype=self.n.dtype)])
+        self.behavior_ids[behavior_type] = behavior_id
+        self.behavior_types.append(behavior_type)
+        return behavior_id
     
     def predict_next_action(self, current_context: Dict[str, Any]) -> Dict[str, Any]:
         """Predict user's next likely action"""
-        current_hour = datetime.now().hour
-        current_day = datetime.now().weekday()
+        now = datetime.now()
+        current_hour = now.hour
+        current_day = now.weekday()
         
-        predictions = {}
+        num_types = len(self.behavior_types)
+        if num_types == 0:
+            return {"predictions": {}, "most_likely": None, "confidence": 0}
         
-        # Analyze patterns for each behavior type
-        for behavior_type, entries in self.behavior_patterns.items():
-            if not entries:
-                continue
-            
-            # Count occurrences by time
-            hour_counts = Counter([entry["hour"] for entry in entries])
-            day_counts = Counter([entry["day_of_week"] for entry in entries])
-            
-            # Calculate probability for current time
-            hour_prob = hour_counts.get(current_hour, 0) / len(entries)
-            day_prob = day_counts.get(current_day, 0) / len(entries)
-            
-            # Combined probability
-            combined_prob = (hour_prob + day_prob) / 2
-            
-            predictions[behavior_type] = {
-                "probability": combined_prob,
-                "hour_frequency": hour_counts.get(current_hour, 0),
-                "day_frequency": day_counts.get(current_day, 0)
-            }
+        totals = self.n[:num_types].astype(np.float64)
+        hour_freq = self.hour_hist[:num_types, current_hour]
+        day_freq = self.day_hist[:num_types, current_day]
+        
+        # Combined probability cho thời điểm hiện tại
+        probabilities = (hour_freq / totals + day_freq / totals) / 2
         
         # Sort by probability
-        sorted_predictions = sorted(
-            predictions.items(), 
-            key=lambda x: x[1]["probability"], 
-            reverse=True
-        )
+        order = np.argsort(-probabilities, kind="stable")
+        sorted_predictions = [
+            (self.behavior_types[i], {
+                "probability": float(probabilities[i]),
+                "hour_frequency": int(hour_freq[i]),
+                "day_frequency": int(day_freq[i])
+            })
+            for i in order
+        ]
         
         return {
             "predictions": dict(sorted_predictions[:5]),  # Top 5
-            "most_likely": sorted_predictions[0] if sorted_predictions else None,
-            "confidence": sorted_predictions[0][1]["probability"] if sorted_predictions else 0
+            "most_likely": sorted_predictions[0],
+            "confidence": sorted_predictions[0][1]["probability"]
         }
     
     def get_usage_insights(self) -> Dict[str, Any]:
         """Insights về usage patterns"""
-        if not self.behavior_patterns:
+        num_types = len(self.behavior_types)
+        if num_types == 0:
             return {"message": "No behavior data collected yet"}
         
         insights = {
@@ -640,27 +1016,26 @@ class BehaviorPredictor:
         }
         
         # All behaviors by hour
-        all_hours = []
-        for entries in self.behavior_patterns.values():
-            all_hours.extend([entry["hour"] for entry in entries])
-        
-        if all_hours:
-            hour_counts = Counter(all_hours)
-            insights["most_active_hours"] = [
-                {"hour": hour, "count": count} 
-                for hour, count in hour_counts.most_common(5)
-            ]
+        hour_counts = self.hour_hist[:num_types].sum(axis=0)
+        day_counts = self.day_hist[:num_types].sum(axis=0)
+        
+        insights["most_active_hours"] = [
+            {"hour": int(hour), "count": int(hour_counts[hour])}
+            for hour in _top_k(hour_counts, 5)
+        ]
         
         # Behavior frequency
-        for behavior_type, entries in self.behavior_patterns.items():
-            insights["behavior_frequency"][behavior_type] = len(entries)
+        insights["behavior_frequency"] = {
+            behavior_type: int(count)
+            for behavior_type, count in zip(self.behavior_types, self.n[:num_types])
+        }
         
         # Detect patterns
         patterns = []
         
         # Morning vs evening preference
-        morning_count = sum(1 for hour in all_hours if 6 <= hour < 12)
-        evening_count = sum(1 for hour in all_hours if 18 <= hour < 24)
+        morning_count = int(hour_counts[6:12].sum())
+        evening_count = int(hour_counts[18:24].sum())
         
         if morning_count > evening_count * 1.5:
             patterns.append("Morning person - more active in AM")
@@ -668,12 +1043,8 @@ class BehaviorPredictor:
             patterns.append("Evening person - more active in PM")
         
         # Weekday vs weekend
-        all_days = []
-        for entries in self.behavior_patterns.values():
-            all_days.extend([entry["day_of_week"] for entry in entries])
-        
-        weekday_count = sum(1 for day in all_days if day < 5)  # Mon-Fri
-        weekend_count = sum(1 for day in all_days if day >= 5)  # Sat-Sun
+        weekday_count = int(day_counts[:5].sum())  # Mon-Fri
+        weekend_count = int(day_counts[5:].sum())  # Sat-Sun
         
         if weekday_count > weekend_count * 2:
             patterns.append("Primarily weekday usage")
@@ -698,11 +1069,25 @@ class PersonalizationSystem:
         self.personalization_engine = PersonalizationEngine(data_dir)
         self.behavior_predictor = BehaviorPredictor(data_dir)
         
+        # Interactions chờ phân tích theo batch
+        self._pending_interactions: List[Dict[str, Any]] = []
+        self.interaction_batch_size = 32
+        self.interaction_flush_interval = 60  # seconds
+        self._last_interaction_flush = time.monotonic()
+        atexit.register(self.flush)
+        
+        # JSON bytes của get_ml_statistics, hợp lệ khi version chưa đổi
+        self._stats_version = 0
+        self._stats_cache_version = -1
+        self._stats_cache: Optional[bytes] = None
+        
         print("✅ Personalization System ready!")
     
     def process_interaction(self, user_input: str, ai_response: str, 
                           context: Dict[str, Any], feedback: Dict[str, Any] = None):
         """Process interaction cho learning"""
+        now = datetime.now()
+        self._stats_version += 1
         
         # Record behavior
         behavior_type = self._classify_interaction_type(user_input)
@@ -710,40 +1095,56 @@ class PersonalizationSystem:
             "user_input_length": len(user_input),
             "response_length": len(ai_response),
             "context": context
-        })
+        }, now)
         
         # RL learning từ feedback
         if feedback and "rating" in feedback:
             response_strategy = self._determine_response_strategy(ai_response)
             self.rl_system.learn_from_feedback(
-                context, response_strategy, feedback["rating"], ai_response
+                context, response_strategy, feedback["rating"], ai_response, now
             )
         
         # Update personalization
         interaction_data = {
             "user_input": user_input,
             "ai_response": ai_response,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
+            "hour": now.hour,
+            "day_of_week": now.weekday(),
             "feedback": feedback.get("text", "") if feedback else "",
             "satisfaction": self._estimate_satisfaction_from_feedback(feedback) if feedback else 0.5
         }
         
-        self.personalization_engine.analyze_user_behavior([interaction_data])
+        self._pending_interactions.append(interaction_data)
+        if (len(self._pending_interactions) >= self.interaction_batch_size or
+                time.monotonic() - self._last_interaction_flush >= self.interaction_flush_interval):
+            self._flush_interactions()
+    
+    def _flush_interactions(self):
+        """Phân tích các interactions đang chờ trong một batch"""
+        self._last_interaction_flush = time.monotonic()
+        if not self._pending_interactions:
+            return
+        batch, self._pending_interactions = self._pending_interactions, []
+        self.personalization_engine.analyze_user_behavior(batch)
+        self._stats_version += 1
+    
+    def flush(self):
+        """Flush toàn bộ dữ liệu đang chờ (interactions, profile, RL feedback)"""
+        self._flush_interactions()
+        self.personalization_engine.flush()
+        self.rl_system.flush()
     
     def _classify_interaction_type(self, user_input: str) -> str:
         """Classify type of interaction"""
-        user_lower = user_input.lower()
-        
         if "?" in user_input:
             return "question"
-        elif any(word in user_lower for word in ["help", "giúp", "hỗ trợ"]):
-            return "help_request"
-        elif any(word in user_lower for word in ["create", "tạo", "make"]):
-            return "creation_request"
-        elif any(word in user_lower for word in ["explain", "giải thích"]):
-            return "explanation_request"
-        else:
-            return "general_conversation"
+        
+        user_lower = user_input.lower()
+        for interaction_type, pattern in _INTERACTION_TYPE_PATTERNS:
+            if pattern.search(user_lower):
+                return interaction_type
+        return "general_conversation"
     
     def _determine_response_strategy(self, ai_response: str) -> str:
         """Determine response strategy từ AI response"""
@@ -753,26 +1154,22 @@ class PersonalizationSystem:
             return "concise_response"
         elif response_length > 100:
             return "detailed_response"
-        elif any(word in ai_response.lower() for word in ["understand", "feel", "support"]):
-            return "empathetic_response"
-        elif any(word in ai_response.lower() for word in ["step", "first", "next", "finally"]):
-            return "helpful_response"
-        elif any(word in ai_response.lower() for word in ["code", "function", "algorithm"]):
-            return "technical_response"
-        else:
-            return "helpful_response"
+        
+        response_lower = ai_response.lower()
+        for strategy, pattern in _RESPONSE_STRATEGY_PATTERNS:
+            if pattern.search(response_lower):
+                return strategy
+        return "helpful_response"
     
     def _estimate_satisfaction_from_feedback(self, feedback: Dict[str, Any]) -> float:
         """Estimate satisfaction từ feedback"""
         if "rating" in feedback:
             return feedback["rating"] / 5.0
         
-        feedback_text = feedback.get("text", "").lower()
-        positive_indicators = ["good", "great", "helpful", "thanks", "perfect"]
-        negative_indicators = ["bad", "wrong", "useless", "terrible"]
+        tokens = set(_WORD_RE.findall(feedback.get("text", "").lower()))
         
-        positive_count = sum(1 for word in positive_indicators if word in feedback_text)
-        negative_count = sum(1 for word in negative_indicators if word in feedback_text)
+        positive_count = len(tokens & _POSITIVE_FEEDBACK_WORDS)
+        negative_count = len(tokens & _NEGATIVE_FEEDBACK_WORDS)
         
         if positive_count > negative_count:
             return 0.8
@@ -803,43 +1200,40 @@ class PersonalizationSystem:
     
     def _combine_strategies(self, rl_guidance: Dict, personalization_recs: Dict) -> Dict[str, Any]:
         """Combine RL và personalization strategies"""
-        combined = {
-            "response_style": "balanced",
-            "length": "medium",
-            "tone": "helpful",
-            "technical_level": "intermediate",
-            "include_examples": True,
-            "empathy_level": "medium"
-        }
-        
-        # Apply RL guidance
-        rl_strategy = rl_guidance.get("strategy", {})
-        if rl_strategy.get("style"):
-            combined["response_style"] = rl_strategy["style"]
+        combined = _DEFAULT_COMBINED.copy()
         
-        if rl_strategy.get("length"):
-            combined["length"] = rl_strategy["length"]
+        # Apply RL guidance, rồi personalization (ưu tiên hơn cho length)
+        rl_strategy = rl_guidance.get("strategy") or _EMPTY
+        person_style = personalization_recs.get("response_style") or _EMPTY
         
-        # Apply personalization
-        person_style = personalization_recs.get("response_style", {})
-        if person_style.get("technical_depth"):
-            combined["technical_level"] = person_style["technical_depth"]
-        
-        if person_style.get("length"):
-            combined["length"] = person_style["length"]
+        for target, source, key in (("response_style", rl_strategy, "style"),
+                                    ("length", rl_strategy, "length"),
+                                    ("technical_level", person_style, "technical_depth"),
+                                    ("length", person_style, "length")):
+            value = source.get(key)
+            if value:
+                combined[target] = value
         
         # Confidence score
-        rl_confidence = rl_guidance.get("confidence", 0)
-        combined["confidence"] = rl_confidence
+        combined["confidence"] = rl_guidance.get("confidence", 0)
         
         return combined
     
-    def get_ml_statistics(self) -> Dict[str, Any]:
-        """Lấy ML system statistics"""
+    def get_ml_statistics(self, as_bytes: bool = False) -> Any:
+        """Lấy ML system statistics, as_bytes=True trả về JSON bytes (cached)"""
+        if not as_bytes:
+            return self._build_ml_statistics()
+        
+        if self._stats_cache_version != self._stats_version:
+            self._stats_cache = _json_dumps(self._build_ml_statistics())
+            self._stats_cache_version = self._stats_version
+        return self._stats_cache
+    
+    def _build_ml_statistics(self) -> Dict[str, Any]:
         return {
             "reinforcement_learning": self.rl_system.get_learning_stats(),
             "user_profile": self.personalization_engine.user_profile,
             "behavior_insights": self.behavior_predictor.get_usage_insights(),
-            "total_interactions": len(self.rl_system.feedback_data),
+            "total_interactions": self.rl_system.total_feedback,
             "personalization_active": True
         }
\ No newline at end of file
@@ -4,11 +4,261 @@ Calendar Integration và Reminder System
 import schedule
 import json
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-from icalendar import Calendar, Event
+import numpy as np
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Optional, Callable, Tuple
 import time
 import threading
+import atexit
+import asyncio
+import bisect
+import heapq
+import itertools
+import secrets
+from collections import defaultdict
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize obj thành UTF-8 JSON bytes (indent 2)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# fsync mỗi file tối đa một lần / khoảng này, trừ khi flush(sync=True)
+_FSYNC_INTERVAL = 30.0
+_last_fsync: Dict[str, float] = {}
+_fsync_lock = threading.Lock()
+
+
+def _write_atomic(path: str, data: bytes, sync: bool = False):
+    """Ghi file qua tmp + os.replace, fsync được amortize"""
+    now = time.monotonic()
+    with _fsync_lock:
+        do_fsync = sync or now - _last_fsync.get(path, float("-inf")) >= _FSYNC_INTERVAL
+    
+    # Tmp riêng cho mỗi thread để các lần ghi đồng thời không dùng chung file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if do_fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    
+    if do_fsync:
+        with _fsync_lock:
+            _last_fsync[path] = now
+
+
+def _strip_cached(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Bỏ các key cache "_..." (timestamp đã parse) trước khi ghi ra file"""
+    return [{k: v for k, v in record.items() if not k.startswith("_")} for record in records]
+
+
+def _to_timestamp(value: str) -> float:
+    """ISO datetime -> POSIX timestamp, inf nếu không hợp lệ"""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+def _compile_time_trigger(trigger: Dict[str, Any]) -> Callable[[Dict[str, Any], str, str], bool]:
+    expected = trigger.get("time")
+    return lambda context, now_hm, text: now_hm == expected
+
+
+def _compile_keyword_trigger(trigger: Dict[str, Any]) -> Callable[[Dict[str, Any], str, str], bool]:
+    keyword = trigger.get("keyword", "").lower()
+    return lambda context, now_hm, text: keyword in text
+
+
+def _compile_context_trigger(trigger: Dict[str, Any]) -> Callable[[Dict[str, Any], str, str], bool]:
+    key = trigger.get("key")
+    expected_value = trigger.get("value")
+    return lambda context, now_hm, text: context.get(key) == expected_value
+
+
+# iCal TEXT escaping (RFC 5545 3.3.11)
+_ICS_ESCAPE_TABLE = str.maketrans({"\\": "\\\\", ";": "\\;", ",": "\\,", "\n": "\\n", "\r": None})
+_ICS_DATETIME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def _ics_line(name: str, value: str) -> bytes:
+    """Content line đã fold theo giới hạn 75 octets"""
+    line = f"{name}:{value}".encode("utf-8")
+    if len(line) <= 75:
+        return line + b"\r\n"
+    
+    # Fold không cắt giữa ký tự UTF-8 (continuation bytes 10xxxxxx)
+    parts = []
+    start, limit = 0, 75
+    while len(line) - start > limit:
+        end = start + limit
+        while line[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(line[start:end])
+        start, limit = end, 74
+    parts.append(line[start:])
+    return b"\r\n ".join(parts) + b"\r\n"
+
+
+# Context keys được index theo (key, value) trong WorkflowAutomation
+_INDEXED_CONTEXT_KEYS = ("hour", "day_of_week")
+
+
+# Trigger type -> compiler tạo predicate(context, now_hm, text_lower)
+_TRIGGER_COMPILERS = {
+    "time": _compile_time_trigger,
+    "keyword": _compile_keyword_trigger,
+    "context": _compile_context_trigger,
+}
+
+
+class _FormatContext(dict):
+    """Context cho format_map: key thiếu được giữ nguyên dạng {key}"""
+    
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def _compile_template(template: str) -> Callable[[_FormatContext], str]:
+    if "{" not in template and "}" not in template:
+        return lambda context: template
+    return template.format_map
+
+
+def _compile_log_action(action: Dict[str, Any]) -> Callable[[_FormatContext], Dict[str, Any]]:
+    render_message = _compile_template(action.get("message", ""))
+    
+    def run(context):
+        message = render_message(context)
+        print(f"📝 Workflow: {message}")
+        return {"success": True, "message": message}
+    return run
+
+
+def _compile_reminder_action(action: Dict[str, Any]) -> Callable[[_FormatContext], Dict[str, Any]]:
+    render_title = _compile_template(action.get("title", ""))
+    render_message = _compile_template(action.get("message", ""))
+    
+    def run(context):
+        title = render_title(context)
+        message = render_message(context)
+        # Tích hợp với CalendarManager nếu có
+        return {"success": True, "reminder_created": title}
+    return run
+
+
+def _compile_command_action(action: Dict[str, Any]) -> Callable[[_FormatContext], Dict[str, Any]]:
+    render_command = _compile_template(action.get("command", ""))
+    
+    def run(context):
+        command = render_command(context)
+        # Execute system command (cần cẩn thận với security)
+        return {"success": True, "command": command}
+    return run
+
+
+# Action type -> compiler tạo callable(format_context) -> result
+_ACTION_COMPILERS = {
+    "log": _compile_log_action,
+    "reminder": _compile_reminder_action,
+    "command": _compile_command_action,
+}
+
+
+def _compile_action(action: Dict[str, Any]) -> Callable[[_FormatContext], Dict[str, Any]]:
+    action_type = action.get("type")
+    compiler = _ACTION_COMPILERS.get(action_type)
+    if compiler is None:
+        result = {"success": False, "error": f"Unknown action type: {action_type}"}
+        return lambda context: dict(result)
+    return compiler(action)
+
+
+def _streaks(meets: np.ndarray) -> Tuple[int, int]:
+    """(best streak, current streak tính từ cuối) của mask ngày đạt target"""
+    if not meets.any():
+        return 0, 0
+    
+    # Biên các run True: +1 là bắt đầu, -1 là kết thúc
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], meets.view(np.int8), [0]))))
+    best = int((edges[1::2] - edges[::2]).max())
+    
+    misses = np.flatnonzero(~meets)
+    current = meets.size if misses.size == 0 else meets.size - 1 - int(misses[-1])
+    return best, current
+
+
+class _DeferredWriter:
+    """Write-behind: gộp nhiều lần save thành một lần ghi file"""
+    
+    flush_delay = 1.0          # seconds sau lần đánh dấu dirty đầu tiên
+    max_pending_writes = 64    # flush ngay khi vượt số lần save đang chờ
+    
+    def _init_deferred_writes(self, writers: Dict[str, Callable[[bool], None]]):
+        self._writers = writers
+        self._dirty = set()
+        self._pending_writes = 0
+        self._flush_lock = threading.Lock()
+        self._dirty_event = threading.Event()
+        
+        thread = threading.Thread(target=self._flush_loop, daemon=True)
+        thread.start()
+        atexit.register(self.flush, sync=True)
+    
+    def _mark_dirty(self, section: str):
+        """Đánh dấu section cần lưu"""
+        with self._flush_lock:
+            self._dirty.add(section)
+            self._pending_writes += 1
+            pending = self._pending_writes
+        
+        if pending >= self.max_pending_writes:
+            self.flush()
+        else:
+            self._dirty_event.set()
+    
+    def flush(self, sync: bool = False):
+        """Ghi tất cả section dirty, sync=True để fsync ngay"""
+        with self._flush_lock:
+            self._dirty_event.clear()
+            dirty, self._dirty = self._dirty, set()
+            self._pending_writes = 0
+            for section in dirty:
+                self._writers[section](sync)
+    
+    def _flush_loop(self):
+        """Background flush: ngủ tới khi có dữ liệu dirty"""
+        while True:
+            self._dirty_event.wait()
+            time.sleep(self.flush_delay)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Deferred write error: {e}")
 
 class CalendarManager:
     """Quản lý calendar và events"""
@@ -20,54 +270,204 @@ class CalendarManager:
         self.events_file = os.path.join(data_dir, "events.json")
         self.reminders_file = os.path.join(data_dir, "reminders.json")
         
-        self.events = self._load_events()
+        events = self._load_events()
         self.reminders = self._load_reminders()
         
+        # Cache timestamp đã parse trên từng event/reminder
+        for event in events:
+            event["_start_ts"] = _to_timestamp(event.get("start_time"))
+            event["_end_ts"] = _to_timestamp(event.get("end_time"))
+        for reminder in self.reminders:
+            reminder["_trigger_ts"] = _to_timestamp(reminder.get("trigger_time"))
+        
+        # Khóa chung cho reminders/pending heap và việc ghi file (monitor thread + caller threads)
+        self._lock = threading.RLock()
+        
+        # Min-heap (trigger_ts, reminder_id) của reminders đang pending
+        self._reminders_by_id = {r["id"]: r for r in self.reminders}
+        self._pending_heap = [
+            (r["_trigger_ts"], r["id"]) for r in self.reminders 
+            if r["status"] == "pending" and r["_trigger_ts"] != float("inf")
+        ]
+        heapq.heapify(self._pending_heap)
+        self.pending_reminder_count = sum(1 for r in self.reminders if r["status"] == "pending")
+        
+        # Tách active / archived một lần, queries chỉ duyệt active
+        self.active_events = [e for e in events if e.get("status") == "active"]
+        self.archived_events = [e for e in events if e.get("status") != "active"]
+        
+        # Index active events theo start timestamp: tuple (times, events) sorted,
+        # luôn thay cả tuple để readers không ghép times và events của hai index khác nhau
+        self._start_index = self._build_start_index(self.active_events)
+        
         # Callback khi có reminder
         self.reminder_callbacks = []
         
+        # Đánh thức monitor khi có reminder mới
+        self._wakeup = threading.Event()
+        self._monitor_thread = None
+        self._monitor_stop = threading.Event()
+        
+        # ID = prefix + tag của instance + sequence, không cần time() mỗi lần
+        self._instance_tag = secrets.token_hex(3)
+        self._event_seq = itertools.count(len(events))
+        self._reminder_seq = itertools.count(len(self.reminders))
+        
+        # Nguồn events ngoài: name -> loader trả về list events
+        self._sources: Dict[str, Callable[[], List[Dict[str, Any]]]] = {}
+        
         print("📅 Calendar Manager initialized")
     
     def _load_events(self) -> List[Dict[str, Any]]:
         """Load events từ file"""
         try:
             if os.path.exists(self.events_file):
-                with open(self.events_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.events_file, 'rb') as f:
+                    return _json_loads(f.read())
         except Exception as e:
             print(f"❌ Error loading events: {e}")
         return []
     
-    def _save_events(self):
+    def _save_events(self, sync: bool = False):
         """Lưu events"""
         try:
-            with open(self.events_file, 'w', encoding='utf-8') as f:
-                json.dump(self.events, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                _write_atomic(self.events_file, _json_dumps(_strip_cached(self.events)), sync)
         except Exception as e:
             print(f"❌ Error saving events: {e}")
     
+    def flush(self, sync: bool = True):
+        """Ghi lại events/reminders, mặc định fsync (dùng khi shutdown)"""
+        self._save_events(sync)
+        self._save_reminders(sync)
+    
     def _load_reminders(self) -> List[Dict[str, Any]]:
         """Load reminders"""
         try:
             if os.path.exists(self.reminders_file):
-                with open(self.reminders_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.reminders_file, 'rb') as f:
+                    return _json_loads(f.read())
         except Exception as e:
             print(f"❌ Error loading reminders: {e}")
         return []
     
-    def _save_reminders(self):
+    def _save_reminders(self, sync: bool = False):
         """Lưu reminders"""
         try:
-            with open(self.reminders_file, 'w', encoding='utf-8') as f:
-                json.dump(self.reminders, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                _write_atomic(self.reminders_file, _json_dumps(_strip_cached(self.reminders)), sync)
         except Exception as e:
             print(f"❌ Error saving reminders: {e}")
     
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+        """Tất cả events (active + archived)"""
+        with self._lock:
+            return self.active_events + self.archived_events
+    
+    def _push_reminder(self, reminder: Dict[str, Any]):
+        """Thêm reminder vào list và pending heap, rồi lưu reminders"""
+        with self._lock:
+            self.reminders.append(reminder)
+            self._reminders_by_id[reminder["id"]] = reminder
+            if reminder["status"] == "pending":
+                self.pending_reminder_count += 1
+            if reminder["_trigger_ts"] != float("inf"):
+                heapq.heappush(self._pending_heap, (reminder["_trigger_ts"], reminder["id"]))
+                self._wakeup.set()
+            self._save_reminders()
+    
+    @staticmethod
+    def _build_start_index(active_events: List[Dict[str, Any]]) -> Tuple[List[float], List[Dict[str, Any]]]:
+        """Build sorted index (start_times, events)"""
+        events = sorted(active_events, key=lambda event: event["_start_ts"])
+        return [event["_start_ts"] for event in events], events
+    
+    def _index_event(self, event: Dict[str, Any]):
+        """Chèn event vào bản copy của sorted index rồi publish (gọi khi giữ self._lock)"""
+        times, events = self._start_index
+        start_ts = event["_start_ts"]
+        i = bisect.bisect_right(times, start_ts)
+        self._start_index = (times[:i] + [start_ts] + times[i:], events[:i] + [event] + events[i:])
+    
+    def _events_between(self, start_ts: float, end_ts: float, include_end: bool = True,
+                        limit: int = None) -> List[Dict[str, Any]]:
+        """Active events có start time trong [start, end]"""
+        # Index chỉ chứa active events; đọc snapshot một lần
+        times, events = self._start_index
+        lo = bisect.bisect_left(times, start_ts)
+        if include_end:
+            hi = bisect.bisect_right(times, end_ts)
+        else:
+            hi = bisect.bisect_left(times, end_ts)
+        
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return events[lo:hi]
+    
+    def add_event_source(self, name: str, loader: Callable[[], List[Dict[str, Any]]]):
+        """Đăng ký nguồn events ngoài, loader chạy trong thread khi refresh"""
+        self._sources[name] = loader
+    
+    async def refresh_sources(self) -> Dict[str, int]:
+        """Fetch song song tất cả nguồn events và merge vào calendar"""
+        if not self._sources:
+            return {}
+        
+        names = list(self._sources)
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._sources[name]) for name in names),
+            return_exceptions=True
+        )
+        
+        fetched = {}
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                print(f"❌ Error refreshing source {name}: {result}")
+                continue
+            fetched[name] = result
+        
+        if fetched:
+            self._merge_source_events(fetched)
+        
+        return {name: len(events) for name, events in fetched.items()}
+    
+    def _merge_source_events(self, fetched: Dict[str, List[Dict[str, Any]]]):
+        """Thay events của các nguồn vừa fetch, rebuild index một lần"""
+        new_events = []
+        for name, source_events in fetched.items():
+            for i, data in enumerate(source_events):
+                event = {
+                    "id": f"{name}_{i}",
+                    "end_time": data.get("start_time"),
+                    "description": "",
+                    "location": "",
+                    "reminder_minutes": 0,
+                    "status": "active",
+                    **data,
+                    "source": name
+                }
+                event["_start_ts"] = _to_timestamp(event.get("start_time"))
+                event["_end_ts"] = _to_timestamp(event.get("end_time"))
+                new_events.append(event)
+        
+        # Build lists mới rồi publish cùng lúc dưới lock
+        with self._lock:
+            active = [e for e in self.active_events if e.get("source") not in fetched]
+            archived = [e for e in self.archived_events if e.get("source") not in fetched]
+            for event in new_events:
+                (active if event["status"] == "active" else archived).append(event)
+            start_index = self._build_start_index(active)
+            
+            self.active_events = active
+            self.archived_events = archived
+            self._start_index = start_index
+            self._save_events()
+    
     def add_event(self, title: str, start_time: str, end_time: str = None,
                   description: str = "", location: str = "", reminder_minutes: int = 15) -> str:
         """Thêm event mới"""
-        event_id = f"event_{len(self.events)}_{int(time.time())}"
+        event_id = f"event_{self._instance_tag}_{next(self._event_seq)}"
         
         event = {
             "id": event_id,
@@ -78,11 +478,15 @@ class CalendarManager:
             "location": location,
             "reminder_minutes": reminder_minutes,
             "created_at": datetime.now().isoformat(),
-            "status": "active"
+            "status": "active",
+            "_start_ts": _to_timestamp(start_time),
+            "_end_ts": _to_timestamp(end_time or start_time)
         }
         
-        self.events.append(event)
-        self._save_events()
+        with self._lock:
+            self.active_events.append(event)
+            self._index_event(event)
+            self._save_events()
         
         # Tạo reminder
         if reminder_minutes > 0:
@@ -103,11 +507,11 @@ class CalendarManager:
                 "trigger_time": reminder_dt.isoformat(),
                 "message": f"Sắp tới sự kiện: {event['title']} lúc {start_dt.strftime('%H:%M')}",
                 "type": "event_reminder",
-                "status": "pending"
+                "status": "pending",
+                "_trigger_ts": reminder_dt.timestamp()
             }
             
-            self.reminders.append(reminder)
-            self._save_reminders()
+            self._push_reminder(reminder)
             
         except Exception as e:
             print(f"❌ Error creating reminder: {e}")
@@ -115,7 +519,7 @@ class CalendarManager:
     def add_reminder(self, title: str, trigger_time: str, message: str, 
                     reminder_type: str = "general") -> str:
         """Thêm reminder độc lập"""
-        reminder_id = f"reminder_{len(self.reminders)}_{int(time.time())}"
+        reminder_id = f"reminder_{self._instance_tag}_{next(self._reminder_seq)}"
         
         reminder = {
             "id": reminder_id,
@@ -124,74 +528,56 @@ class CalendarManager:
             "message": message,
             "type": reminder_type,
             "status": "pending",
-            "created_at": datetime.now().isoformat()
+            "created_at": datetime.now().isoformat(),
+            "_trigger_ts": _to_timestamp(trigger_time)
         }
         
-        self.reminders.append(reminder)
-        self._save_reminders()
+        self._push_reminder(reminder)
         
         return reminder_id
     
-    def get_upcoming_events(self, days: int = 7) -> List[Dict[str, Any]]:
-        """Lấy events sắp tới"""
+    def get_upcoming_events(self, days: int = 7, limit: int = None) -> List[Dict[str, Any]]:
+        """Lấy events sắp tới (tối đa limit events đầu tiên)"""
         now = datetime.now()
         end_date = now + timedelta(days=days)
         
-        upcoming = []
-        for event in self.events:
-            if event["status"] != "active":
-                continue
-                
-            try:
-                event_start = datetime.fromisoformat(event["start_time"])
-                if now <= event_start <= end_date:
-                    upcoming.append(event)
-            except:
-                continue
-        
-        # Sort by start time
-        upcoming.sort(key=lambda x: x["start_time"])
-        return upcoming
+        # Index đã sort theo start time
+        return self._events_between(now.timestamp(), end_date.timestamp(), limit=limit)
     
-    def get_today_events(self) -> List[Dict[str, Any]]:
-        """Lấy events hôm nay"""
-        today = datetime.now().date()
+    def get_today_events(self, limit: int = None) -> List[Dict[str, Any]]:
+        """Lấy events hôm nay (tối đa limit events đầu tiên)"""
+        day_start = datetime.combine(datetime.now().date(), datetime.min.time())
+        day_end = day_start + timedelta(days=1)
         
-        today_events = []
-        for event in self.events:
-            if event["status"] != "active":
-                continue
-                
-            try:
-                event_date = datetime.fromisoformat(event["start_time"]).date()
-                if event_date == today:
-                    today_events.append(event)
-            except:
-                continue
-        
-        return today_events
+        return self._events_between(day_start.timestamp(), day_end.timestamp(), 
+                                    include_end=False, limit=limit)
     
-    def check_reminders(self) -> List[Dict[str, Any]]:
+    def check_reminders(self, now: datetime = None) -> List[Dict[str, Any]]:
         """Kiểm tra reminders cần trigger"""
-        now = datetime.now()
+        now = now or datetime.now()
+        now_ts = now.timestamp()
+        now_iso = now.isoformat()
+        
         triggered_reminders = []
         
-        for reminder in self.reminders:
-            if reminder["status"] != "pending":
-                continue
+        with self._lock:
+            # Chỉ pop các reminders đã đến hạn
+            heap = self._pending_heap
+            while heap and heap[0][0] <= now_ts:
+                _, reminder_id = heapq.heappop(heap)
+                reminder = self._reminders_by_id.get(reminder_id)
+                if reminder is None or reminder["status"] != "pending":
+                    continue
+                
+                reminder["status"] = "triggered"
+                self.pending_reminder_count -= 1
+                reminder["triggered_at"] = now_iso
+                triggered_reminders.append(reminder)
             
-            try:
-                trigger_time = datetime.fromisoformat(reminder["trigger_time"])
-                if now >= trigger_time:
-                    triggered_reminders.append(reminder)
-                    reminder["status"] = "triggered"
-                    reminder["triggered_at"] = now.isoformat()
-            except:
-                continue
+            if triggered_reminders:
+                self._save_reminders()
         
         if triggered_reminders:
-            self._save_reminders()
-            
             # Call callbacks
             for callback in self.reminder_callbacks:
                 try:
@@ -201,62 +587,90 @@ class CalendarManager:
         
         return triggered_reminders
     
+    def next_reminder_ts(self) -> Optional[float]:
+        """Timestamp của reminder pending gần nhất"""
+        with self._lock:
+            return self._pending_heap[0][0] if self._pending_heap else None
+    
     def add_reminder_callback(self, callback):
         """Thêm callback cho reminders"""
         self.reminder_callbacks.append(callback)
     
     def start_reminder_monitor(self):
         """Bắt đầu monitor reminders"""
+        if self._monitor_thread and self._monitor_thread.is_alive():
+            return
+        
+        self._monitor_stop.clear()
+        
         def monitor_loop():
-            while True:
+            while not self._monitor_stop.is_set():
                 try:
+                    self._wakeup.clear()
                     self.check_reminders()
-                    time.sleep(60)  # Check every minute
+                    
+                    # Ngủ tới reminder kế tiếp hoặc khi có reminder mới;
+                    # cap 1 giờ để bắt kịp nếu đồng hồ hệ thống bị chỉnh
+                    timeout = 3600
+                    next_ts = self.next_reminder_ts()
+                    if next_ts is not None:
+                        timeout = min(timeout, max(0, next_ts - time.time()))
+                    self._wakeup.wait(timeout)
                 except Exception as e:
                     print(f"❌ Reminder monitor error: {e}")
-                    time.sleep(300)  # Wait 5 minutes on error
+                    self._monitor_stop.wait(300)  # Wait 5 minutes on error
         
-        thread = threading.Thread(target=monitor_loop, daemon=True)
-        thread.start()
+        self._monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
+        self._monitor_thread.start()
         print("⏰ Reminder monitor started")
     
+    def stop_reminder_monitor(self, timeout: float = 5):
+        """Dừng monitor reminders"""
+        self._monitor_stop.set()
+        self._wakeup.set()
+        if self._monitor_thread:
+            self._monitor_thread.join(timeout=timeout)
+            if not self._monitor_thread.is_alive():
+                self._monitor_thread = None
+    
     def export_to_ical(self, filename: str = None) -> str:
         """Export events to iCal format"""
         if not filename:
             filename = os.path.join(self.data_dir, "events.ics")
         
-        cal = Calendar()
-        cal.add('prodid', '-//AI Assistant//Calendar//EN')
-        cal.add('version', '2.0')
+        buf = bytearray(b"BEGIN:VCALENDAR\r\n")
+        buf += _ics_line("PRODID", "-//AI Assistant//Calendar//EN")
+        buf += _ics_line("VERSION", "2.0")
         
-        for event_data in self.events:
-            if event_data["status"] != "active":
-                continue
-            
+        for event_data in self.active_events:
             try:
-                event = Event()
-                event.add('summary', event_data["title"])
-                event.add('dtstart', datetime.fromisoformat(event_data["start_time"]))
-                event.add('dtend', datetime.fromisoformat(event_data["end_time"]))
-                
-                if event_data["description"]:
-                    event.add('description', event_data["description"])
-                if event_data["location"]:
-                    event.add('location', event_data["location"])
-                
-                cal.add_component(event)
-            except Exception as e:
+                dtstart = datetime.fromtimestamp(event_data["_start_ts"]).strftime(_ICS_DATETIME_FORMAT)
+                dtend = datetime.fromtimestamp(event_data["_end_ts"]).strftime(_ICS_DATETIME_FORMAT)
+            except (OverflowError, ValueError, OSError) as e:
                 print(f"❌ Error adding event to iCal: {e}")
+                continue
+            
+            buf += b"BEGIN:VEVENT\r\n"
+            buf += _ics_line("SUMMARY", event_data["title"].translate(_ICS_ESCAPE_TABLE))
+            buf += _ics_line("DTSTART", dtstart)
+            buf += _ics_line("DTEND", dtend)
+            if event_data["description"]:
+                buf += _ics_line("DESCRIPTION", event_data["description"].translate(_ICS_ESCAPE_TABLE))
+            if event_data["location"]:
+                buf += _ics_line("LOCATION", event_data["location"].translate(_ICS_ESCAPE_TABLE))
+            buf += b"END:VEVENT\r\n"
+        
+        buf += b"END:VCALENDAR\r\n"
         
         try:
             with open(filename, 'wb') as f:
-                f.write(cal.to_ical())
+                f.write(buf)
             return filename
         except Exception as e:
             print(f"❌ Error saving iCal: {e}")
             return ""
 
-class HabitTracker:
+class HabitTracker(_DeferredWriter):
     """Theo dõi habits"""
     
     def __init__(self, data_dir: str = "data/habits"):
@@ -268,6 +682,23 @@ class HabitTracker:
         
         self.habits = self._load_habits()
         self.logs = self._load_logs()
+        self.habits_by_id = {h["id"]: h for h in self.habits}
+        self.active_habit_count = sum(1 for h in self.habits if h["status"] == "active")
+        
+        # (habit_id, date) -> log entry
+        self._log_index = {(log["habit_id"], log["date"]): log for log in self.logs}
+        
+        # Habits đã đạt target hôm nay, tính lại khi sang ngày mới
+        self._completed_today_date = None
+        self._completed_today = set()
+        
+        # habit_id -> {date ordinal: tổng value}, build lại khi logs thay đổi
+        self._logs_by_habit_date = None
+        
+        self._init_deferred_writes({"habits": self._save_habits, "logs": self._save_logs})
+        
+        self._instance_tag = secrets.token_hex(3)
+        self._habit_seq = itertools.count(len(self.habits))
         
         print("📈 Habit Tracker initialized")
     
@@ -275,17 +706,16 @@ class HabitTracker:
         """Load habits"""
         try:
             if os.path.exists(self.habits_file):
-                with open(self.habits_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.habits_file, 'rb') as f:
+                    return _json_loads(f.read())
         except Exception as e:
             print(f"❌ Error loading habits: {e}")
         return []
     
-    def _save_habits(self):
+    def _save_habits(self, sync: bool = False):
         """Lưu habits"""
         try:
-            with open(self.habits_file, 'w', encoding='utf-8') as f:
-                json.dump(self.habits, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.habits_file, _json_dumps(self.habits), sync)
         except Exception as e:
             print(f"❌ Error saving habits: {e}")
     
@@ -293,24 +723,23 @@ class HabitTracker:
         """Load habit logs"""
         try:
             if os.path.exists(self.logs_file):
-                with open(self.logs_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.logs_file, 'rb') as f:
+                    return _json_loads(f.read())
         except Exception as e:
             print(f"❌ Error loading logs: {e}")
         return []
     
-    def _save_logs(self):
+    def _save_logs(self, sync: bool = False):
         """Lưu logs"""
         try:
-            with open(self.logs_file, 'w', encoding='utf-8') as f:
-                json.dump(self.logs, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.logs_file, _json_dumps(self.logs), sync)
         except Exception as e:
             print(f"❌ Error saving logs: {e}")
     
     def add_habit(self, name: str, description: str = "", 
                   frequency: str = "daily", target_value: int = 1) -> str:
         """Thêm habit mới"""
-        habit_id = f"habit_{len(self.habits)}_{int(time.time())}"
+        habit_id = f"habit_{self._instance_tag}_{next(self._habit_seq)}"
         
         habit = {
             "id": habit_id,
@@ -323,93 +752,102 @@ class HabitTracker:
         }
         
         self.habits.append(habit)
-        self._save_habits()
+        self.habits_by_id[habit_id] = habit
+        self.active_habit_count += 1
+        self._mark_dirty("habits")
         
         return habit_id
     
     def log_habit(self, habit_id: str, value: int = 1, note: str = "") -> bool:
         """Log habit completion"""
-        today = datetime.now().date().isoformat()
+        now = datetime.now()
+        today = now.date().isoformat()
+        now_iso = now.isoformat()
         
         log_entry = {
             "habit_id": habit_id,
             "date": today,
             "value": value,
             "note": note,
-            "logged_at": datetime.now().isoformat()
+            "logged_at": now_iso
         }
         
         # Check if already logged today
-        for log in self.logs:
-            if log["habit_id"] == habit_id and log["date"] == today:
-                log["value"] += value
-                log["note"] = note
-                log["logged_at"] = datetime.now().isoformat()
-                self._save_logs()
-                return True
-        
-        # Add new log
-        self.logs.append(log_entry)
-        self._save_logs()
+        key = (habit_id, today)
+        log = self._log_index.get(key)
+        if log is not None:
+            log["value"] += value
+            log["note"] = note
+            log["logged_at"] = now_iso
+        else:
+            # Add new log
+            log = log_entry
+            self.logs.append(log)
+            self._log_index[key] = log
+        
+        habit = self.habits_by_id.get(habit_id)
+        if (self._completed_today_date == today and habit 
+                and habit["status"] == "active" and log["value"] >= habit["target_value"]):
+            self._completed_today.add(habit_id)
+        
+        self._logs_by_habit_date = None
+        self._mark_dirty("logs")
         return True
     
+    def completed_today_count(self) -> int:
+        """Số active habits đã đạt target hôm nay"""
+        today = datetime.now().date().isoformat()
+        if self._completed_today_date != today:
+            completed = set()
+            for habit in self.habits:
+                if habit["status"] != "active":
+                    continue
+                entry = self._log_index.get((habit["id"], today))
+                if entry and entry["value"] >= habit["target_value"]:
+                    completed.add(habit["id"])
+            self._completed_today = completed
+            self._completed_today_date = today
+        return len(self._completed_today)
+    
+    def _get_day_values(self, habit_id: str) -> Dict[int, int]:
+        """Tổng value theo ngày (date ordinal) của một habit"""
+        if self._logs_by_habit_date is None:
+            index = defaultdict(lambda: defaultdict(int))
+            for log in self.logs:
+                try:
+                    day = date.fromisoformat(log["date"]).toordinal()
+                except (TypeError, ValueError):
+                    continue
+                index[log["habit_id"]][day] += log["value"]
+            self._logs_by_habit_date = index
+        return self._logs_by_habit_date.get(habit_id, {})
+    
     def get_habit_stats(self, habit_id: str, days: int = 30) -> Dict[str, Any]:
         """Lấy thống kê habit"""
-        habit = next((h for h in self.habits if h["id"] == habit_id), None)
+        habit = self.habits_by_id.get(habit_id)
         if not habit:
             return {}
         
-        # Get logs for this habit
-        habit_logs = [log for log in self.logs if log["habit_id"] == habit_id]
-        
-        # Calculate stats for last N days
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days)
-        
-        completed_days = 0
-        total_value = 0
-        streak = 0
-        current_streak = 0
+        # Daily totals for this habit
+        day_values = self._get_day_values(habit_id)
         
-        # Check each day
-        current_date = start_date
-        consecutive_days = 0
+        # Calculate stats for last N days (start..end inclusive)
+        end_ordinal = datetime.now().date().toordinal()
+        start_ordinal = end_ordinal - days
+        num_days = max(days + 1, 0)
         
-        while current_date <= end_date:
-            date_str = current_date.isoformat()
-            day_logs = [log for log in habit_logs if log["date"] == date_str]
-            
-            if day_logs:
-                day_value = sum(log["value"] for log in day_logs)
-                total_value += day_value
-                
-                if day_value >= habit["target_value"]:
-                    completed_days += 1
-                    consecutive_days += 1
-                    streak = max(streak, consecutive_days)
-                else:
-                    consecutive_days = 0
-            else:
-                consecutive_days = 0
-            
-            current_date += timedelta(days=1)
+        daily = np.zeros(num_days, dtype=np.int64)
+        logged = np.zeros(num_days, dtype=bool)
+        for offset in range(num_days):
+            day_value = day_values.get(start_ordinal + offset)
+            if day_value is not None:
+                daily[offset] = day_value
+                logged[offset] = True
         
-        # Current streak (from today backwards)
-        current_date = end_date
-        while current_date >= start_date:
-            date_str = current_date.isoformat()
-            day_logs = [log for log in habit_logs if log["date"] == date_str]
-            
-            if day_logs:
-                day_value = sum(log["value"] for log in day_logs)
-                if day_value >= habit["target_value"]:
-                    current_streak += 1
-                else:
-                    break
-            else:
-                break
-            
-            current_date -= timedelta(days=1)
+        meets = logged & (daily >= habit["target_value"])
+        completed_days = int(meets.sum())
+        total_value = int(daily.sum())
+        streak, current_streak = _streaks(meets)
         
         completion_rate = (completed_days / days) * 100 if days > 0 else 0
         
@@ -434,10 +872,8 @@ class HabitTracker:
                 continue
             
             # Check if already completed today
-            today_logs = [log for log in self.logs 
-                         if log["habit_id"] == habit["id"] and log["date"] == today]
-            
-            completed_value = sum(log["value"] for log in today_logs)
+            entry = self._log_index.get((habit["id"], today))
+            completed_value = entry["value"] if entry else 0
             is_completed = completed_value >= habit["target_value"]
             
             today_habits.append({
@@ -450,7 +886,7 @@ class HabitTracker:
         
         return today_habits
 
-class WorkflowAutomation:
+class WorkflowAutomation(_DeferredWriter):
     """Workflow Automation System"""
     
     def __init__(self, data_dir: str = "data/workflows"):
@@ -462,6 +898,25 @@ class WorkflowAutomation:
         
         self.workflows = self._load_workflows()
         self.executions = self._load_executions()
+        self.workflows_by_id = {w["id"]: w for w in self.workflows}
+        self.active_workflow_count = sum(1 for w in self.workflows if w["status"] == "active")
+        
+        # Compiled actions theo workflow id
+        self._compiled_actions = {}
+        
+        # Compiled triggers: workflows có time trigger được bucket theo "HH:MM",
+        # workflows có context trigger hour/day_of_week theo (key, value)
+        self._time_buckets = defaultdict(list)
+        self._context_buckets = defaultdict(list)
+        self._untimed_workflows = []
+        for workflow in self.workflows:
+            self._compile_workflow(workflow)
+        
+        self._init_deferred_writes({"workflows": self._save_workflows, "executions": self._save_executions})
+        
+        self._instance_tag = secrets.token_hex(3)
+        self._workflow_seq = itertools.count(len(self.workflows))
+        self._execution_seq = itertools.count(len(self.executions))
         
         print("⚙️ Workflow Automation initialized")
     
@@ -469,17 +924,16 @@ class WorkflowAutomation:
         """Load workflows"""
         try:
             if os.path.exists(self.workflows_file):
-                with open(self.workflows_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.workflows_file, 'rb') as f:
+                    return _json_loads(f.read())
         except Exception as e:
             print(f"❌ Error loading workflows: {e}")
         return []
     
-    def _save_workflows(self):
+    def _save_workflows(self, sync: bool = False):
         """Lưu workflows"""
         try:
-            with open(self.workflows_file, 'w', encoding='utf-8') as f:
-                json.dump(self.workflows, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.workflows_file, _json_dumps(self.workflows), sync)
         except Exception as e:
             print(f"❌ Error saving workflows: {e}")
     
@@ -487,17 +941,16 @@ class WorkflowAutomation:
         """Load executions"""
         try:
             if os.path.exists(self.executions_file):
-                with open(self.executions_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.executions_file, 'rb') as f:
+                    return _json_loads(f.read())
         except Exception as e:
             print(f"❌ Error loading executions: {e}")
         return []
     
-    def _save_executions(self):
+    def _save_executions(self, sync: bool = False):
         """Lưu executions"""
         try:
-            with open(self.executions_file, 'w', encoding='utf-8') as f:
-                json.dump(self.executions, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.executions_file, _json_dumps(self.executions), sync)
         except Exception as e:
             print(f"❌ Error saving executions: {e}")
     
@@ -505,7 +958,7 @@ class WorkflowAutomation:
                        triggers: List[Dict[str, Any]], 
                        actions: List[Dict[str, Any]]) -> str:
         """Tạo workflow mới"""
-        workflow_id = f"workflow_{len(self.workflows)}_{int(time.time())}"
+        workflow_id = f"workflow_{self._instance_tag}_{next(self._workflow_seq)}"
         
         workflow = {
             "id": workflow_id,
@@ -519,59 +972,98 @@ class WorkflowAutomation:
         }
         
         self.workflows.append(workflow)
-        self._save_workflows()
+        self.workflows_by_id[workflow_id] = workflow
+        self.active_workflow_count += 1
+        self._compile_workflow(workflow)
+        self._mark_dirty("workflows")
         
         return workflow_id
     
-    def check_triggers(self, context: Dict[str, Any]) -> List[str]:
-        """Kiểm tra workflows cần trigger"""
-        triggered_workflows = []
+    def _compile_workflow(self, workflow: Dict[str, Any]):
+        """Compile actions + triggers thành callables, đưa triggers vào bucket"""
+        self._compiled_actions[workflow["id"]] = [
+            _compile_action(action) for action in workflow["actions"]
+        ]
         
-        for workflow in self.workflows:
-            if workflow["status"] != "active":
+        predicates = []
+        required_keys = set()
+        time_key = None
+        context_key = None
+        
+        for trigger in workflow["triggers"]:
+            compiler = _TRIGGER_COMPILERS.get(trigger.get("type"))
+            if compiler is None:
+                # Unknown trigger type không bao giờ match
+                return
+            if (trigger.get("type") == "time" and time_key is None 
+                    and trigger.get("time") is not None):
+                # Bucket key đã đảm bảo trigger này match
+                time_key = trigger.get("time")
                 continue
+            if (trigger.get("type") == "context" and context_key is None
+                    and trigger.get("key") in _INDEXED_CONTEXT_KEYS
+                    and isinstance(trigger.get("value"), (int, str))):
+                context_key = (trigger.get("key"), trigger.get("value"))
+                continue
+            predicates.append(compiler(trigger))
             
-            should_trigger = True
-            for trigger in workflow["triggers"]:
-                if not self._evaluate_trigger(trigger, context):
-                    should_trigger = False
-                    break
-            
-            if should_trigger:
-                triggered_workflows.append(workflow["id"])
+            # Context keys bắt buộc phải có thì trigger mới có thể match
+            if trigger.get("type") == "keyword" and trigger.get("keyword"):
+                required_keys.add("text")
+            elif trigger.get("type") == "context" and trigger.get("value") is not None:
+                required_keys.add(trigger.get("key"))
         
-        return triggered_workflows
+        if time_key is not None and context_key is not None:
+            # Time bucket chọn lọc hơn, context trigger quay lại làm predicate
+            key, value = context_key
+            predicates.append(lambda context, now_hm, text: context.get(key) == value)
+            required_keys.add(key)
+            context_key = None
+        
+        entry = (workflow, predicates, frozenset(required_keys))
+        if time_key is not None:
+            self._time_buckets[time_key].append(entry)
+        elif context_key is not None:
+            self._context_buckets[context_key].append(entry)
+        else:
+            self._untimed_workflows.append(entry)
     
-    def _evaluate_trigger(self, trigger: Dict[str, Any], context: Dict[str, Any]) -> bool:
-        """Evaluate trigger condition"""
-        trigger_type = trigger.get("type")
+    def check_triggers(self, context: Dict[str, Any], now: datetime = None) -> List[str]:
+        """Kiểm tra workflows cần trigger"""
+        now = now or datetime.now()
+        now_hm = f"{now.hour:02d}:{now.minute:02d}"
+        text = context.get("text", "").lower()
         
-        if trigger_type == "time":
-            # Time-based trigger
-            current_time = datetime.now().strftime("%H:%M")
-            return current_time == trigger.get("time")
+        triggered_workflows = []
         
-        elif trigger_type == "keyword":
-            # Keyword trigger
-            text = context.get("text", "").lower()
-            keyword = trigger.get("keyword", "").lower()
-            return keyword in text
+        # Chỉ xét workflows không được index + bucket của phút/giờ/thứ hiện tại
+        buckets = [self._untimed_workflows, self._time_buckets.get(now_hm, ())]
+        for key in _INDEXED_CONTEXT_KEYS:
+            if key in context and self._context_buckets:
+                buckets.append(self._context_buckets.get((key, context[key]), ()))
         
-        elif trigger_type == "context":
-            # Context-based trigger
-            key = trigger.get("key")
-            expected_value = trigger.get("value")
-            return context.get(key) == expected_value
+        context_keys = context.keys()
+        for entries in buckets:
+            for workflow, predicates, required_keys in entries:
+                if workflow["status"] != "active":
+                    continue
+                
+                # Bỏ qua workflows thiếu context keys cần thiết
+                if required_keys and not context_keys >= required_keys:
+                    continue
+                
+                if all(predicate(context, now_hm, text) for predicate in predicates):
+                    triggered_workflows.append(workflow["id"])
         
-        return False
+        return triggered_workflows
     
     def execute_workflow(self, workflow_id: str, context: Dict[str, Any] = None) -> Dict[str, Any]:
         """Thực hiện workflow"""
-        workflow = next((w for w in self.workflows if w["id"] == workflow_id), None)
+        workflow = self.workflows_by_id.get(workflow_id)
         if not workflow:
             return {"success": False, "error": "Workflow not found"}
         
-        execution_id = f"exec_{int(time.time())}"
+        execution_id = f"exec_{self._instance_tag}_{next(self._execution_seq)}"
         execution = {
             "id": execution_id,
             "workflow_id": workflow_id,
@@ -583,8 +1075,9 @@ class WorkflowAutomation:
         
         try:
             # Execute actions
-            for action in workflow["actions"]:
-                result = self._execute_action(action, context or {})
+            format_context = _FormatContext(context or {})
+            for run_action in self._compiled_actions[workflow_id]:
+                result = run_action(format_context)
                 execution["results"].append(result)
                 
                 if not result.get("success", False):
@@ -605,33 +1098,11 @@ class WorkflowAutomation:
         
         # Save execution
         self.executions.append(execution)
-        self._save_executions()
-        self._save_workflows()
+        self._mark_dirty("executions")
+        self._mark_dirty("workflows")
         
         return {
             "success": execution["status"] in ["completed"],
             "execution_id": execution_id,
             "results": execution["results"]
         }
-    
-    def _execute_action(self, action: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
-        """Thực hiện action"""
-        action_type = action.get("type")
-        
-        if action_type == "log":
-            message = action.get("message", "").format(**context)
-            print(f"📝 Workflow: {message}")
-            return {"success": True, "message": message}
-        
-        elif action_type == "reminder":
-            title = action.get("title", "").format(**context)
-            message = action.get("message", "").format(**context)
-            # Tích hợp với CalendarManager nếu có
-            return {"success": True, "reminder_created": title}
-        
-        elif action_type == "command":
-            command = action.get("command", "").format(**context)
-            # Execute system command (cần cẩn thận với security)
-            return {"success": True, "command": command}
-        
-        return {"success": False, "error": f"Unknown action type: {action_type}"}
\ No newline at end of file
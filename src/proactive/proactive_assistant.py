@@ -1,12 +1,96 @@
 """
 Proactive Assistant System tích hợp Calendar, Habits, Workflows
 """
+import re
+import inspect
 import threading
 import time
+import heapq
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable
 from .calendar_manager import CalendarManager, HabitTracker, WorkflowAutomation
 
+# Proactive jobs theo lịch: key -> (giờ trong ngày, weekdays hoặc None = mọi ngày)
+_DAILY_JOBS = {
+    "morning_briefing": ((8,), None),
+    "evening_summary": ((18,), None),
+    "habit_reminder": ((9, 14, 20), None),         # 9 AM, 2 PM, 8 PM
+    "work_planning": ((9,), (0, 1, 2, 3, 4)),      # Weekday mornings
+    "break_suggestion": ((10, 15), None),          # 10 AM, 3 PM
+    "weekend_planning": ((17,), (4,)),             # Friday evening
+}
+
+# Workflow triggers được kiểm tra theo các mốc 5 phút
+_WORKFLOW_CHECK_INTERVAL = timedelta(minutes=5)
+
+# Intent phrases theo thứ tự ưu tiên, mỗi intent là một regex alternation
+_INTENT_PHRASES = (
+    ("event", ("tạo lịch", "add event", "đặt lịch", "meeting")),
+    ("habit", ("đã làm", "hoàn thành", "completed", "done")),
+    ("reminder", ("nhắc nhở", "remind", "nhắc tôi")),
+    ("query", ("lịch", "schedule", "calendar", "habit", "thói quen")),
+)
+
+_INTENT_PATTERNS = tuple(
+    (intent, re.compile("|".join(map(re.escape, phrases))))
+    for intent, phrases in _INTENT_PHRASES
+)
+
+# Patterns cho parsing yêu cầu tạo event
+_TIME_PATTERNS = (
+    re.compile(r'(\d{1,2}):(\d{2})'),  # 14:30
+    re.compile(r'(\d{1,2})h(\d{2})'),  # 14h30
+    re.compile(r'(\d{1,2}) giờ'),      # 2 giờ
+)
+
+_DATE_PATTERNS = (
+    re.compile(r'hôm nay'),
+    re.compile(r'ngày mai'),
+    re.compile(r'(\d{1,2})/(\d{1,2})'),  # 25/12
+)
+
+_TITLE_PATTERNS = (
+    re.compile(r'(?:tạo lịch|add event|đặt lịch|meeting)\s+(.+?)(?:\s+lúc|\s+vào|\s+at|$)', re.IGNORECASE),
+    re.compile(r'(.+?)\s+(?:lúc|vào|at)\s+', re.IGNORECASE),
+)
+
+def _accepts_notification_batch(callback: Callable) -> bool:
+    """Callback nhận list notifications nếu tham số đầu tên là `notifications`"""
+    try:
+        params = list(inspect.signature(callback).parameters)
+    except (TypeError, ValueError):
+        return False
+    return bool(params) and params[0] == "notifications"
+
+
+# Thời gian sống của briefing/summary đã render
+_DAILY_CACHE_TTL = 15 * 60  # seconds
+
+# Job trễ quá ngưỡng này (vd. máy sleep) thì bỏ qua lần đó
+_MISFIRE_GRACE = timedelta(minutes=5)
+
+
+def _next_fire_time(key: str, after: datetime) -> datetime:
+    """Thời điểm chạy kế tiếp (> after) của một job"""
+    if key == "workflow_check":
+        interval = int(_WORKFLOW_CHECK_INTERVAL.total_seconds())
+        midnight = after.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = int((after - midnight).total_seconds())
+        return midnight + timedelta(seconds=(elapsed // interval + 1) * interval)
+    
+    hours, weekdays = _DAILY_JOBS[key]
+    day = after.replace(minute=0, second=0, microsecond=0)
+    for day_offset in range(8):
+        candidate_day = day + timedelta(days=day_offset)
+        if weekdays is not None and candidate_day.weekday() not in weekdays:
+            continue
+        for hour in hours:
+            candidate = candidate_day.replace(hour=hour)
+            if candidate > after:
+                return candidate
+    raise ValueError(f"No fire time for job {key}")
+
 class ProactiveAssistant:
     """Assistant chủ động với calendar, habits, workflows"""
     
@@ -20,22 +104,63 @@ class ProactiveAssistant:
         self.habits = HabitTracker(f"{data_dir}/habits") 
         self.workflows = WorkflowAutomation(f"{data_dir}/workflows")
         
-        # Notification callbacks
-        self.notification_callbacks = []
+        # Notification callbacks: tuple (callback, nhận batch?) copy-on-write,
+        # đọc không cần lock
+        self._notification_targets = ()
         
-        # Proactive monitoring
+        # Notifications gom trong một tick, None khi không trong tick
+        self._pending_notifications = None
+        
+        # Proactive monitoring: min-heap (due_timestamp, job_key)
         self.monitoring_active = False
         self.monitoring_thread = None
+        self._schedule = []
+        self._wake_event = threading.Event()
+        self._monitor_lock = threading.Lock()
+        
+        # Pool chạy workflows song song (tạo khi cần, shutdown khi stop);
+        # tạo/submit/shutdown đều giữ _monitor_lock
+        self._workflow_pool = None
+        
+        # Notification kind -> (date, hour) lần gửi gần nhất
+        self._last_reminder_fires: Dict[str, tuple] = {}
+        
+        # Error backoff / log dedup cho proactive loop
+        self._consecutive_errors = 0
+        self._last_error = None
+        self._last_error_repeats = 0
+        
+        # Intent -> parser cho process_natural_language_request
+        self._intent_handlers = {
+            "event": self._parse_event_request,
+            "habit": self._parse_habit_completion,
+            "reminder": self._parse_reminder_request,
+            "query": self._parse_query_request,
+        }
         
         # Daily summary cache
         self.last_daily_summary = None
         self.last_summary_date = None
         
+        # (date, "briefing"|"summary") -> (text, created monotonic time)
+        self._briefing_cache: Dict[tuple, tuple] = {}
+        
         print("✅ Proactive Assistant ready!")
     
-    def add_notification_callback(self, callback: Callable):
-        """Thêm callback cho notifications"""
-        self.notification_callbacks.append(callback)
+    @property
+    def notification_callbacks(self) -> tuple:
+        return tuple(callback for callback, _ in self._notification_targets)
+    
+    def add_notification_callback(self, callback: Callable, batch: bool = None):
+        """Thêm callback cho notifications
+        
+        batch=True: callback nhận list notifications của mỗi tick. Mặc định
+        tự nhận biết qua tên tham số đầu (`notifications`).
+        """
+        if batch is None:
+            batch = _accepts_notification_batch(callback)
+        self._notification_targets = self._notification_targets + ((callback, batch),)
+        self._ensure_monitoring_thread()
     
     def start_proactive_monitoring(self):
         """Bắt đầu proactive monitoring"""
@@ -47,141 +172,282 @@ class ProactiveAssistant:
         # Start calendar reminder monitoring
         self.calendar.start_reminder_monitor()
         
-        # Start main proactive loop
-        self.monitoring_thread = threading.Thread(
-            target=self._proactive_loop, 
-            daemon=True
-        )
-        self.monitoring_thread.start()
-        
-        print("👀 Proactive monitoring started")
+        # Start main proactive loop (hoãn tới khi có việc để làm)
+        if self._ensure_monitoring_thread():
+            print("👀 Proactive monitoring started")
+        else:
+            print("💤 Proactive monitoring idle until callbacks/workflows are added")
+    
+    def _has_proactive_work(self) -> bool:
+        """Có nơi nhận notifications hoặc workflows cần kiểm tra"""
+        return bool(self._notification_targets) or bool(self.workflows.workflows)
+    
+    def _ensure_monitoring_thread(self) -> bool:
+        """Start proactive thread nếu monitoring đang bật và có việc"""
+        with self._monitor_lock:
+            if not self.monitoring_active or not self._has_proactive_work():
+                return False
+            if self.monitoring_thread and self.monitoring_thread.is_alive():
+                return True
+            
+            self._wake_event.clear()
+            now = datetime.now()
+            self._schedule = [
+                (_next_fire_time(key, now).timestamp(), key)
+                for key in (*_DAILY_JOBS, "workflow_check")
+            ]
+            heapq.heapify(self._schedule)
+            
+            self.monitoring_thread = threading.Thread(
+                target=self._proactive_loop, 
+                daemon=True
+            )
+            self.monitoring_thread.start()
+            return True
     
     def stop_proactive_monitoring(self):
         """Dừng proactive monitoring"""
         self.monitoring_active = False
+        self._wake_event.set()
         if self.monitoring_thread:
             self.monitoring_thread.join(timeout=5)
+            if not self.monitoring_thread.is_alive():
+                self.monitoring_thread = None
+        self.calendar.stop_reminder_monitor()
+        with self._monitor_lock:
+            pool, self._workflow_pool = self._workflow_pool, None
+        if pool:
+            pool.shutdown(wait=False)
         print("🛑 Proactive monitoring stopped")
     
     def _proactive_loop(self):
-        """Main proactive monitoring loop"""
+        """Main proactive monitoring loop: ngủ tới job kế tiếp trong heap"""
         while self.monitoring_active:
+            # Không còn việc thì thoát, add_* sẽ start lại khi cần
+            with self._monitor_lock:
+                if not self._has_proactive_work():
+                    self.monitoring_thread = None
+                    return
+            
             try:
-                # Check every 5 minutes
-                self._check_proactive_opportunities()
-                time.sleep(300)  # 5 minutes
+                delay = self._schedule[0][0] - time.time()
+                if delay > 0:
+                    # Thức dậy khi tới hạn hoặc khi stop; clear để lần wait sau không trả về ngay
+                    self._wake_event.wait(timeout=delay)
+                    self._wake_event.clear()
+                    continue
+                
+                now = datetime.now()
+                self._check_proactive_opportunities(self._pop_due_jobs(now), now)
+                self._consecutive_errors = 0
             except Exception as e:
-                print(f"❌ Proactive loop error: {e}")
-                time.sleep(60)  # Wait 1 minute on error
+                self._consecutive_errors += 1
+                
+                # Lỗi lặp lại chỉ log mỗi 10 lần
+                error_key = repr(e)
+                if error_key != self._last_error:
+                    self._last_error = error_key
+                    self._last_error_repeats = 0
+                if self._last_error_repeats % 10 == 0:
+                    print(f"❌ Proactive loop error: {e}")
+                self._last_error_repeats += 1
+                
+                # Exponential backoff: 10s, 20s, ... tối đa 5 phút
+                backoff = min(300, 5 * 2 ** min(self._consecutive_errors, 6))
+                self._wake_event.wait(timeout=backoff)
+                self._wake_event.clear()
     
-    def _check_proactive_opportunities(self):
-        """Kiểm tra cơ hội để proactive"""
-        current_time = datetime.now()
-        
+    def _pop_due_jobs(self, now: datetime) -> set:
+        """Pop các jobs đã tới hạn và đặt lịch lần chạy kế tiếp"""
+        now_ts = now.timestamp()
+        
+        due_jobs = set()
+        while self._schedule and self._schedule[0][0] <= now_ts:
+            due_ts, key = heapq.heappop(self._schedule)
+            if now - datetime.fromtimestamp(due_ts) <= _MISFIRE_GRACE:
+                due_jobs.add(key)
+            heapq.heappush(self._schedule, (_next_fire_time(key, now).timestamp(), key))
+        
+        return due_jobs
+    
+    def _check_proactive_opportunities(self, due_jobs: set, now: datetime):
+        """Chạy các proactive jobs đã tới hạn, dùng chung một `now`"""
+        # Gom notifications của tick, dispatch một lần ở cuối
+        self._pending_notifications = []
+        
+        # Dữ liệu trong ngày dùng chung cho các checks của tick (lazy fetch)
+        tick_ctx = {"now": now, "today_events": None, "today_habits": None, "habit_split": None}
+        try:
+            self._run_due_jobs(due_jobs, tick_ctx)
+        finally:
+            batch, self._pending_notifications = self._pending_notifications, None
+            if batch:
+                self._dispatch_notifications(batch)
+    
+    def _run_due_jobs(self, due_jobs: set, tick_ctx: Dict[str, Any]):
         # Morning briefing (8 AM)
-        if current_time.hour == 8 and current_time.minute < 5:
-            self._send_morning_briefing()
+        if "morning_briefing" in due_jobs:
+            self._send_morning_briefing(tick_ctx)
         
         # Evening summary (6 PM)
-        elif current_time.hour == 18 and current_time.minute < 5:
-            self._send_evening_summary()
+        elif "evening_summary" in due_jobs:
+            self._send_evening_summary(tick_ctx)
         
         # Habit reminders
-        self._check_habit_reminders()
+        if "habit_reminder" in due_jobs:
+            self._check_habit_reminders(tick_ctx)
         
         # Workflow triggers
-        self._check_workflow_triggers()
+        if "workflow_check" in due_jobs:
+            self._check_workflow_triggers(tick_ctx["now"])
         
         # Smart suggestions
-        self._generate_smart_suggestions()
+        self._generate_smart_suggestions(due_jobs, tick_ctx)
+    
+    def _get_today_events(self, tick_ctx: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Events hôm nay, cache trong tick_ctx nếu có"""
+        if tick_ctx is None:
+            return self.calendar.get_today_events()
+        if tick_ctx["today_events"] is None:
+            tick_ctx["today_events"] = self.calendar.get_today_events()
+        return tick_ctx["today_events"]
+    
+    def _get_today_habits(self, tick_ctx: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Habits hôm nay, cache trong tick_ctx nếu có"""
+        if tick_ctx is None:
+            return self.habits.get_today_habits()
+        if tick_ctx["today_habits"] is None:
+            tick_ctx["today_habits"] = self.habits.get_today_habits()
+        return tick_ctx["today_habits"]
     
-    def _send_morning_briefing(self):
+    def _split_today_habits(self, tick_ctx: Optional[Dict[str, Any]] = None) -> tuple:
+        """(completed, incomplete) habits hôm nay, chia trong một lượt duyệt"""
+        if tick_ctx is not None and tick_ctx["habit_split"] is not None:
+            return tick_ctx["habit_split"]
+        
+        completed, incomplete = [], []
+        for habit in self._get_today_habits(tick_ctx):
+            (completed if habit["is_completed"] else incomplete).append(habit)
+        
+        if tick_ctx is not None:
+            tick_ctx["habit_split"] = (completed, incomplete)
+        return completed, incomplete
+    
+    def _send_morning_briefing(self, tick_ctx: Dict[str, Any]):
         """Gửi briefing buổi sáng"""
-        if self.last_summary_date == datetime.now().date():
+        today = tick_ctx["now"].date()
+        if self.last_summary_date == today:
             return  # Already sent today
         
-        briefing = self.get_daily_briefing()
+        briefing = self.get_daily_briefing(tick_ctx=tick_ctx)
         self._send_notification(
             title="🌅 Good Morning Briefing",
             message=briefing,
-            type="daily_briefing"
+            notification_type="daily_briefing"
         )
         
-        self.last_summary_date = datetime.now().date()
+        self.last_summary_date = today
     
-    def _send_evening_summary(self):
+    def _send_evening_summary(self, tick_ctx: Dict[str, Any]):
         """Gửi summary buổi tối"""
-        summary = self.get_daily_summary()
+        summary = self.get_daily_summary(tick_ctx=tick_ctx)
         self._send_notification(
             title="🌇 Evening Summary",
             message=summary,
-            type="daily_summary"
+            notification_type="daily_summary"
         )
     
-    def _check_habit_reminders(self):
+    def _claim_fire_slot(self, kind: str, now: datetime) -> bool:
+        """True nếu kind chưa được gửi trong giờ hiện tại (và đánh dấu đã gửi)"""
+        slot = (now.date(), now.hour)
+        if self._last_reminder_fires.get(kind) == slot:
+            return False
+        self._last_reminder_fires[kind] = slot
+        return True
+    
+    def _check_habit_reminders(self, tick_ctx: Dict[str, Any]):
         """Kiểm tra habit reminders"""
-        today_habits = self.habits.get_today_habits()
+        if not self._claim_fire_slot("habit_reminder", tick_ctx["now"]):
+            return
         
-        incomplete_habits = [
-            habit for habit in today_habits 
-            if not habit["is_completed"]
-        ]
+        _, incomplete_habits = self._split_today_habits(tick_ctx)
+        habit_names = [h["habit"]["name"] for h in incomplete_habits[:3]]
         
-        # Remind at specific times
-        current_hour = datetime.now().hour
-        if current_hour in [9, 14, 20] and incomplete_habits:  # 9 AM, 2 PM, 8 PM
-            habit_names = [h["habit"]["name"] for h in incomplete_habits[:3]]
+        # Lịch nhắc (9 AM, 2 PM, 8 PM) do scheduler quyết định
+        if habit_names:
             message = f"⏰ Nhắc nhở habits: {', '.join(habit_names)}"
             
             self._send_notification(
                 title="📈 Habit Reminder",
                 message=message,
-                type="habit_reminder"
+                notification_type="habit_reminder"
             )
     
-    def _check_workflow_triggers(self):
+    def _check_workflow_triggers(self, now: datetime):
         """Kiểm tra workflow triggers"""
+        # Không có workflow active thì không cần dựng context
+        if not self.workflows.active_workflow_count:
+            return
+        
         context = {
-            "time": datetime.now().strftime("%H:%M"),
-            "hour": datetime.now().hour,
-            "day_of_week": datetime.now().weekday(),
-            "date": datetime.now().date().isoformat()
+            "time": f"{now.hour:02d}:{now.minute:02d}",
+            "hour": now.hour,
+            "day_of_week": now.weekday(),
+            "date": now.date().isoformat()
         }
         
-        triggered_workflows = self.workflows.check_triggers(context)
+        triggered_workflows = self.workflows.check_triggers(context, now)
+        if not triggered_workflows:
+            return
+        
+        with self._monitor_lock:
+            # stop_proactive_monitoring đã chạy: không tạo pool mới
+            if not self.monitoring_active:
+                return
+            if self._workflow_pool is None:
+                self._workflow_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wf")
+            
+            futures = {
+                self._workflow_pool.submit(self.workflows.execute_workflow, workflow_id, context): workflow_id
+                for workflow_id in triggered_workflows
+            }
         
-        for workflow_id in triggered_workflows:
-            result = self.workflows.execute_workflow(workflow_id, context)
+        # Notify theo thứ tự hoàn thành
+        for future in as_completed(futures):
+            workflow_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Workflow {workflow_id} error: {e}")
+                continue
             
             if result["success"]:
                 self._send_notification(
                     title="⚙️ Workflow Executed",
                     message=f"Workflow {workflow_id} completed successfully",
-                    type="workflow_notification"
+                    notification_type="workflow_notification"
                 )
     
-    def _generate_smart_suggestions(self):
+    def _generate_smart_suggestions(self, due_jobs: set, tick_ctx: Dict[str, Any]):
         """Tạo smart suggestions"""
-        current_time = datetime.now()
-        
+        now = tick_ctx["now"]
         # Suggestion based on time and context
         suggestions = []
         
-        # Work time suggestions (9 AM - 5 PM on weekdays)
-        if (current_time.weekday() < 5 and 
-            9 <= current_time.hour <= 17):
+        # Work time suggestions (weekday mornings)
+        if "work_planning" in due_jobs and self._claim_fire_slot("work_planning", now):
             
             # Check if no events scheduled
-            today_events = self.calendar.get_today_events()
+            today_events = self._get_today_events(tick_ctx)
             if not today_events:
                 suggestions.append("📅 Bạn chưa có lịch hẹn nào hôm nay. Có cần lập kế hoạch?")
         
         # Break time suggestions
-        if current_time.hour in [10, 15]:  # 10 AM, 3 PM
+        if "break_suggestion" in due_jobs and self._claim_fire_slot("break_suggestion", now):  # 10 AM, 3 PM
             suggestions.append("☕ Đã đến giờ nghỉ giải lao. Hãy đứng dậy và vận động nhẹ!")
         
         # Weekend planning (Friday evening)
-        if current_time.weekday() == 4 and current_time.hour >= 17:
+        if "weekend_planning" in due_jobs and self._claim_fire_slot("weekend_planning", now):
             suggestions.append("🎉 Cuối tuần sắp đến! Bạn có kế hoạch gì không?")
         
         # Send suggestions
@@ -189,7 +455,7 @@ class ProactiveAssistant:
             self._send_notification(
                 title="💡 Smart Suggestion",
                 message=suggestion,
-                type="smart_suggestion"
+                notification_type="smart_suggestion"
             )
     
     def _send_notification(self, title: str, message: str, 
@@ -202,25 +468,61 @@ class ProactiveAssistant:
             "timestamp": datetime.now().isoformat()
         }
         
-        for callback in self.notification_callbacks:
+        if self._pending_notifications is not None:
+            self._pending_notifications.append(notification)
+        else:
+            self._dispatch_notifications([notification])
+    
+    def _dispatch_notifications(self, notifications: List[Dict[str, Any]]):
+        """Gọi callbacks: batch callbacks một lần, còn lại từng notification"""
+        targets = self._notification_targets
+        for callback, batch in targets:
             try:
-                callback(notification)
+                if batch:
+                    callback(notifications)
+                else:
+                    for notification in notifications:
+                        callback(notification)
             except Exception as e:
                 print(f"❌ Notification callback error: {e}")
     
-    def get_daily_briefing(self) -> str:
+    def invalidate_daily_cache(self):
+        """Xóa briefing/summary đã cache (gọi khi events/habits thay đổi)"""
+        self._briefing_cache = {}
+    
+    def _get_cached_daily(self, key: tuple) -> Optional[str]:
+        cached = self._briefing_cache.get(key)
+        if cached and time.monotonic() - cached[1] < _DAILY_CACHE_TTL:
+            return cached[0]
+        return None
+    
+    def _set_cached_daily(self, key: tuple, text: str):
+        # Chỉ giữ cache của ngày hiện tại
+        self._briefing_cache = {
+            k: v for k, v in self._briefing_cache.items() if k[0] == key[0]
+        }
+        self._briefing_cache[key] = (text, time.monotonic())
+    
+    def get_daily_briefing(self, tick_ctx: Optional[Dict[str, Any]] = None) -> str:
         """Tạo daily briefing"""
-        today = datetime.now().date()
+        today = (tick_ctx["now"] if tick_ctx else datetime.now()).date()
+        cache_key = (today, "briefing")
+        cached = self._get_cached_daily(cache_key)
+        if cached is not None:
+            return cached
         
         # Today's events
-        today_events = self.calendar.get_today_events()
+        if tick_ctx is None:
+            today_events = self.calendar.get_today_events(limit=5)
+        else:
+            today_events = self._get_today_events(tick_ctx)[:5]
         
         # Today's habits
-        today_habits = self.habits.get_today_habits()
-        incomplete_habits = [h for h in today_habits if not h["is_completed"]]
+        _, incomplete_habits = self._split_today_habits(tick_ctx)
+        incomplete_habits = incomplete_habits[:5]
         
         # Upcoming events (next 3 days)
-        upcoming_events = self.calendar.get_upcoming_events(3)
+        upcoming_events = self.calendar.get_upcoming_events(3, limit=3)
         
         briefing_parts = [
             f"📅 **Daily Briefing - {today.strftime('%A, %B %d')}**\n"
@@ -229,8 +531,8 @@ class ProactiveAssistant:
         # Today's schedule
         if today_events:
             briefing_parts.append("**📋 Lịch hôm nay:**")
-            for event in today_events[:5]:
-                time_str = datetime.fromisoformat(event["start_time"]).strftime("%H:%M")
+            for event in today_events:
+                time_str = datetime.fromtimestamp(event["_start_ts"]).strftime("%H:%M")
                 briefing_parts.append(f"• {time_str} - {event['title']}")
         else:
             briefing_parts.append("📋 Không có lịch hẹn nào hôm nay")
@@ -238,47 +540,51 @@ class ProactiveAssistant:
         # Habits to complete
         if incomplete_habits:
             briefing_parts.append("\n**📈 Habits cần hoàn thành:**")
-            for habit in incomplete_habits[:5]:
+            for habit in incomplete_habits:
                 progress = habit["progress"]
                 briefing_parts.append(f"• {habit['habit']['name']} ({progress:.0f}%)")
         
         # Upcoming events
         if upcoming_events:
             briefing_parts.append("\n**⏰ Sắp tới:**")
-            for event in upcoming_events[:3]:
-                date_str = datetime.fromisoformat(event["start_time"]).strftime("%m/%d %H:%M")
+            for event in upcoming_events:
+                date_str = datetime.fromtimestamp(event["_start_ts"]).strftime("%m/%d %H:%M")
                 briefing_parts.append(f"• {date_str} - {event['title']}")
         
         briefing_parts.append("\n✨ Chúc bạn một ngày tốt lành!")
         
-        return "\n".join(briefing_parts)
+        briefing = "\n".join(briefing_parts)
+        self._set_cached_daily(cache_key, briefing)
+        return briefing
     
-    def get_daily_summary(self) -> str:
+    def get_daily_summary(self, tick_ctx: Optional[Dict[str, Any]] = None) -> str:
         """Tạo daily summary"""
-        today = datetime.now().date()
+        today = (tick_ctx["now"] if tick_ctx else datetime.now()).date()
+        cache_key = (today, "summary")
+        cached = self._get_cached_daily(cache_key)
+        if cached is not None:
+            return cached
         
         # Today's completed habits
-        today_habits = self.habits.get_today_habits()
-        completed_habits = [h for h in today_habits if h["is_completed"]]
-        
-        # Today's events that happened
-        today_events = self.calendar.get_today_events()
+        completed_habits, incomplete_habits = self._split_today_habits(tick_ctx)
+        habit_count = len(completed_habits) + len(incomplete_habits)
         
         summary_parts = [
             f"🌇 **Daily Summary - {today.strftime('%A, %B %d')}**\n"
         ]
         
         # Habit completion
-        if today_habits:
-            completion_rate = (len(completed_habits) / len(today_habits)) * 100
-            summary_parts.append(f"📈 **Habits:** {len(completed_habits)}/{len(today_habits)} hoàn thành ({completion_rate:.0f}%)")
+        if habit_count:
+            completion_rate = (len(completed_habits) / habit_count) * 100
+            summary_parts.append(f"📈 **Habits:** {len(completed_habits)}/{habit_count} hoàn thành ({completion_rate:.0f}%)")
             
             if completed_habits:
                 summary_parts.append("✅ Đã hoàn thành:")
                 for habit in completed_habits:
                     summary_parts.append(f"• {habit['habit']['name']}")
         
-        # Events summary
+        # Events summary: today's events that happened
+        today_events = self._get_today_events(tick_ctx)
         if today_events:
             summary_parts.append(f"\n📅 **Lịch hẹn:** {len(today_events)} sự kiện hôm nay")
         
@@ -288,15 +594,19 @@ class ProactiveAssistant:
         
         summary_parts.append("\n💤 Chúc bạn ngủ ngon và nghỉ ngơi tốt!")
         
-        return "\n".join(summary_parts)
+        summary = "\n".join(summary_parts)
+        self._set_cached_daily(cache_key, summary)
+        return summary
     
     # Calendar methods
     def add_event(self, title: str, start_time: str, **kwargs) -> str:
         """Thêm event và tự động tạo reminder"""
+        self.invalidate_daily_cache()
         return self.calendar.add_event(title, start_time, **kwargs)
     
     def add_reminder(self, title: str, trigger_time: str, message: str) -> str:
         """Thêm reminder"""
+        self.invalidate_daily_cache()
         return self.calendar.add_reminder(title, trigger_time, message)
     
     def get_upcoming_events(self, days: int = 7) -> List[Dict[str, Any]]:
@@ -306,10 +616,12 @@ class ProactiveAssistant:
     # Habit methods
     def add_habit(self, name: str, **kwargs) -> str:
         """Thêm habit mới"""
+        self.invalidate_daily_cache()
         return self.habits.add_habit(name, **kwargs)
     
     def log_habit(self, habit_id: str, value: int = 1, note: str = "") -> bool:
         """Log habit completion"""
+        self.invalidate_daily_cache()
         return self.habits.log_habit(habit_id, value, note)
     
     def get_habit_stats(self, habit_id: str, days: int = 30) -> Dict[str, Any]:
@@ -320,7 +632,9 @@ class ProactiveAssistant:
     def create_workflow(self, name: str, description: str, 
                        triggers: List[Dict], actions: List[Dict]) -> str:
         """Tạo workflow automation"""
-        return self.workflows.create_workflow(name, description, triggers, actions)
+        workflow_id = self.workflows.create_workflow(name, description, triggers, actions)
+        self._ensure_monitoring_thread()
+        return workflow_id
     
     def execute_workflow(self, workflow_id: str, context: Dict = None) -> Dict:
         """Thực hiện workflow manually"""
@@ -331,68 +645,36 @@ class ProactiveAssistant:
         """Xử lý yêu cầu bằng ngôn ngữ tự nhiên"""
         request_lower = request.lower()
         
-        # Event creation
-        if any(phrase in request_lower for phrase in 
-               ["tạo lịch", "add event", "đặt lịch", "meeting"]):
-            return self._parse_event_request(request)
-        
-        # Habit logging
-        elif any(phrase in request_lower for phrase in 
-                ["đã làm", "hoàn thành", "completed", "done"]):
-            return self._parse_habit_completion(request)
-        
-        # Reminder creation
-        elif any(phrase in request_lower for phrase in 
-                ["nhắc nhở", "remind", "nhắc tôi"]):
-            return self._parse_reminder_request(request)
-        
-        # Query requests
-        elif any(phrase in request_lower for phrase in 
-                ["lịch", "schedule", "calendar", "habit", "thói quen"]):
-            return self._parse_query_request(request)
+        # Event creation > habit logging > reminder creation > query
+        for intent, pattern in _INTENT_PATTERNS:
+            if pattern.search(request_lower):
+                return self._intent_handlers[intent](request, request_lower)
         
         return {"type": "unknown", "message": "Không hiểu yêu cầu"}
     
-    def _parse_event_request(self, request: str) -> Dict[str, Any]:
+    def _parse_event_request(self, request: str, request_lower: str = None) -> Dict[str, Any]:
         """Parse event creation request"""
         # Simple parsing (có thể enhance với NLP)
-        import re
         
         # Extract time patterns
-        time_patterns = [
-            r'(\d{1,2}):(\d{2})',  # 14:30
-            r'(\d{1,2})h(\d{2})',  # 14h30
-            r'(\d{1,2}) giờ',      # 2 giờ
-        ]
-        
         time_match = None
-        for pattern in time_patterns:
-            time_match = re.search(pattern, request)
+        for pattern in _TIME_PATTERNS:
+            time_match = pattern.search(request)
             if time_match:
                 break
         
         # Extract date patterns
-        date_patterns = [
-            r'hôm nay',
-            r'ngày mai',
-            r'(\d{1,2})/(\d{1,2})',  # 25/12
-        ]
-        
         date_info = "hôm nay"  # default
-        for pattern in date_patterns:
-            if re.search(pattern, request):
-                date_info = re.search(pattern, request).group()
+        for pattern in _DATE_PATTERNS:
+            date_match = pattern.search(request)
+            if date_match:
+                date_info = date_match.group()
                 break
         
         # Parse event title (words after "tạo lịch" or "meeting")
-        title_patterns = [
-            r'(?:tạo lịch|add event|đặt lịh|meeting)\s+(.+?)(?:\s+lúc|\s+vào|\s+at|$)',
-            r'(.+?)\s+(?:lúc|vào|at)\s+',
-        ]
-        
         title = "Sự kiện mới"  # default
-        for pattern in title_patterns:
-            title_match = re.search(pattern, request, re.IGNORECASE)
+        for pattern in _TITLE_PATTERNS:
+            title_match = pattern.search(request)
             if title_match:
                 title = title_match.group(1).strip()
                 break
@@ -405,15 +687,18 @@ class ProactiveAssistant:
             "raw_request": request
         }
     
-    def _parse_habit_completion(self, request: str) -> Dict[str, Any]:
+    def _parse_habit_completion(self, request: str, request_lower: str = None) -> Dict[str, Any]:
         """Parse habit completion request"""
+        if request_lower is None:
+            request_lower = request.lower()
+        
         # Extract habit name
         completion_phrases = ["đã làm", "hoàn thành", "completed", "done"]
         
         for phrase in completion_phrases:
-            if phrase in request.lower():
+            if phrase in request_lower:
                 # Get text after the phrase
-                parts = request.lower().split(phrase)
+                parts = request_lower.split(phrase)
                 if len(parts) > 1:
                     habit_name = parts[1].strip()
                     return {
@@ -424,7 +709,7 @@ class ProactiveAssistant:
         
         return {"type": "habit_completion", "message": "Không xác định được habit"}
     
-    def _parse_reminder_request(self, request: str) -> Dict[str, Any]:
+    def _parse_reminder_request(self, request: str, request_lower: str = None) -> Dict[str, Any]:
         """Parse reminder creation request"""
         # Similar parsing logic for reminders
         return {
@@ -433,9 +718,12 @@ class ProactiveAssistant:
             "raw_request": request
         }
     
-    def _parse_query_request(self, request: str) -> Dict[str, Any]:
+    def _parse_query_request(self, request: str, request_lower: str = None) -> Dict[str, Any]:
         """Parse query request"""
-        if "lịch" in request.lower() or "schedule" in request.lower():
+        if request_lower is None:
+            request_lower = request.lower()
+        
+        if "lịch" in request_lower or "schedule" in request_lower:
             events = self.get_upcoming_events(7)
             return {
                 "type": "schedule_query",
@@ -443,7 +731,7 @@ class ProactiveAssistant:
                 "count": len(events)
             }
         
-        elif "habit" in request.lower() or "thói quen" in request.lower():
+        elif "habit" in request_lower or "thói quen" in request_lower:
             today_habits = self.habits.get_today_habits()
             return {
                 "type": "habit_query", 
@@ -455,20 +743,21 @@ class ProactiveAssistant:
     
     def get_proactive_stats(self) -> Dict[str, Any]:
         """Lấy thống kê proactive system"""
+        # Counters được các managers cập nhật incrementally
         return {
             "calendar": {
                 "total_events": len(self.calendar.events),
                 "upcoming_events": len(self.get_upcoming_events(7)),
-                "active_reminders": len([r for r in self.calendar.reminders if r["status"] == "pending"])
+                "active_reminders": self.calendar.pending_reminder_count
             },
             "habits": {
                 "total_habits": len(self.habits.habits),
-                "active_habits": len([h for h in self.habits.habits if h["status"] == "active"]),
-                "today_completion": len([h for h in self.habits.get_today_habits() if h["is_completed"]])
+                "active_habits": self.habits.active_habit_count,
+                "today_completion": self.habits.completed_today_count()
             },
             "workflows": {
                 "total_workflows": len(self.workflows.workflows),
-                "active_workflows": len([w for w in self.workflows.workflows if w["status"] == "active"])
+                "active_workflows": self.workflows.active_workflow_count
             },
             "monitoring_active": self.monitoring_active
         }
\ No newline at end of file
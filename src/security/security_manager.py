@@ -2,16 +2,211 @@
 Security & Privacy Manager cho AI Assistant
 """
 import os
+import re
 import json
+import bisect
 import hashlib
-import secrets
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Union
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+import hmac
+import struct
+import threading
+import time
+import atexit
+import functools
+import itertools
+import queue
+import asyncio
+import contextlib
+import mmap
+import traceback
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Union, Callable
 import base64
-import bcrypt
+from types import MappingProxyType, SimpleNamespace
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+# Encoders stdlib dựng sẵn cho fallback khi không có orjson:
+# indent cho file người đọc (settings/permissions), compact cho audit log
+_JSON_FILE_ENCODER = json.JSONEncoder(ensure_ascii=False, indent=2)
+_JSON_LINE_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize obj thành UTF-8 JSON bytes (indent 2)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return _JSON_FILE_ENCODER.encode(obj).encode('utf-8')
+
+
+def _json_dumps_line(obj: Any) -> bytes:
+    """Serialize obj thành một dòng JSON (compact, kết thúc bằng newline)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (_JSON_LINE_ENCODER.encode(obj) + '\n').encode('utf-8')
+
+
+def _json_dumps_compact(obj: Any) -> bytes:
+    """Serialize obj thành UTF-8 JSON bytes compact"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return _JSON_LINE_ENCODER.encode(obj).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _write_atomic(path: str, data: bytes, sync: bool = True):
+    """Ghi file qua tmp + os.replace để crash giữa chừng không làm hỏng file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _payload_from_other(data: Any) -> bytes:
+    # Subclass của dict/list vẫn serialize JSON, còn lại dùng str()
+    if isinstance(data, (dict, list)):
+        return _json_dumps_compact(data)
+    return str(data).encode('utf-8')
+
+
+# type(data) -> plaintext bytes cho encrypt_data
+_PAYLOAD_ENCODERS = {
+    dict: _json_dumps_compact,
+    list: _json_dumps_compact,
+    str: lambda data: data.encode('utf-8'),
+    bytes: lambda data: data,
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _crypto() -> SimpleNamespace:
+    """Import cryptography lần đầu cần tới (bỏ qua khi encryption không dùng)"""
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    
+    return SimpleNamespace(
+        Fernet=Fernet, hashes=hashes, Cipher=Cipher, algorithms=algorithms,
+        modes=modes, PBKDF2HMAC=PBKDF2HMAC, Scrypt=Scrypt
+    )
+
+
+@contextlib.contextmanager
+def _mapped_file(path: str):
+    """Map file read-only, yield memoryview (b"" nếu file rỗng)"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                yield view
+            except BaseException as e:
+                # Frames trong traceback còn giữ slices của view, mmap sẽ không close được
+                traceback.clear_frames(e.__traceback__)
+                raise
+            finally:
+                view.release()
+
+
+def _advise_sequential(f):
+    """Báo kernel đọc tuần tự để readahead mạnh hơn (nếu hỗ trợ)"""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def _random_bytes(n: int) -> bytes:
+    """Random bytes trực tiếp qua getrandom() (Linux), fallback os.urandom"""
+    try:
+        return os.getrandom(n)
+    except (AttributeError, OSError):
+        return os.urandom(n)
+
+
+# rfernet: Fernet viết bằng Rust, cùng định dạng key/token
+try:
+    import rfernet
+    RFERNET_AVAILABLE = True
+except ImportError:
+    RFERNET_AVAILABLE = False
+
+
+class _RFernet:
+    """Bọc rfernet.Fernet (API str) thành API bytes như cryptography Fernet"""
+    
+    __slots__ = ("_fernet",)
+    
+    def __init__(self, key: bytes):
+        self._fernet = rfernet.Fernet(key.decode("ascii"))
+    
+    def encrypt(self, data: Union[bytes, memoryview]) -> bytes:
+        if type(data) is not bytes:
+            data = bytes(data)
+        return self._fernet.encrypt(data).encode("ascii")
+    
+    def decrypt(self, token: Union[bytes, str]) -> bytes:
+        if type(token) is not str:
+            token = bytes(token).decode("ascii")
+        return self._fernet.decrypt(token)
+
+
+def _make_fernet(key: bytes):
+    """Fernet cho key base64, ưu tiên backend rfernet nếu có"""
+    if RFERNET_AVAILABLE:
+        return _RFernet(key)
+    return _crypto().Fernet(key)
+
+
+# Token raw (không base64, chỉ dùng nội bộ):
+# magic | timestamp (8 bytes) | iv (16 bytes) | AES-CBC ciphertext | HMAC-SHA256
+# Token Fernet là base64 (bắt đầu bằng "g") nên magic 0x81 không bị nhầm
+_RAW_MAGIC = b"\x81"
+_RAW_HEADER_SIZE = 1 + 8 + 16
+_HMAC_SIZE = 32
+
+# File lớn được encrypt dạng stream: magic | iv | AES-CTR ciphertext | HMAC-SHA256
+_STREAM_MAGIC = b"\x82"
+_STREAM_HEADER_SIZE = 1 + 16
+_STREAM_CHUNK_SIZE = 64 * 1024
+_STREAM_THRESHOLD = 4 * 1024 * 1024
+
+
+# KDF cho key mới: scrypt (memory-hard, ~32 MB/lần derive).
+# Cài đặt cũ không có kdf file vẫn dùng PBKDF2 cho tới khi đặt password mới.
+_SCRYPT_PARAMS = {"name": "scrypt", "n": 2 ** 15, "r": 8, "p": 1}
+_LEGACY_KDF_PARAMS = {"name": "pbkdf2_sha256", "iterations": 100000}
+
+
+def _derive_key(salt: bytes, password: bytes, params: Dict[str, Any]) -> bytes:
+    """Derive Fernet key (base64) từ password theo KDF params"""
+    crypto = _crypto()
+    if params["name"] == "scrypt":
+        kdf = crypto.Scrypt(salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"])
+    else:
+        kdf = crypto.PBKDF2HMAC(
+            algorithm=crypto.hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=params["iterations"],
+        )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
 
 class EncryptionManager:
     """Quản lý encryption cho dữ liệu nhạy cảm"""
@@ -22,10 +217,15 @@ class EncryptionManager:
         
         self.key_file = os.path.join(data_dir, "encryption.key")
         self.salt_file = os.path.join(data_dir, "salt.key")
+        self.kdf_file = os.path.join(data_dir, "kdf.json")
         
         # Initialize encryption
         self.salt = self._get_or_create_salt()
+        self.kdf_params = self._load_kdf_params()
         self.fernet = None
+        self._key = None
+        self._signing_key = None
+        self._encryption_key = None
         
         print("🔐 Encryption Manager initialized")
     
@@ -36,32 +236,69 @@ class EncryptionManager:
                 with open(self.salt_file, 'rb') as f:
                     return f.read()
             else:
-                salt = os.urandom(16)
-                with open(self.salt_file, 'wb') as f:
-                    f.write(salt)
+                salt = _random_bytes(16)
+                _write_atomic(self.salt_file, salt)
                 return salt
         except Exception as e:
             print(f"❌ Salt error: {e}")
-            return os.urandom(16)
+            return _random_bytes(16)
+    
+    def _load_kdf_params(self) -> Dict[str, Any]:
+        """KDF params đã lưu; key cũ không có file thì là PBKDF2"""
+        try:
+            if os.path.exists(self.kdf_file):
+                with open(self.kdf_file, 'rb') as f:
+                    return _json_loads(f.read())
+        except Exception as e:
+            print(f"❌ KDF params error: {e}")
+        
+        if os.path.exists(self.key_file):
+            return dict(_LEGACY_KDF_PARAMS)
+        return dict(_SCRYPT_PARAMS)
+    
+    def _derive(self, password: str) -> bytes:
+        """Derive key từ password (KDF chạy trong C, nhả GIL)"""
+        return _derive_key(self.salt, password.encode(), self.kdf_params)
+    
+    async def set_password_async(self, password: str) -> bool:
+        """set_password không block event loop (KDF chạy ở executor)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.set_password, password)
+    
+    def set_password_with_callback(self, password: str, callback: Callable[[bool], None]):
+        """set_password ở background thread, gọi callback(success) khi xong"""
+        def run():
+            callback(self.set_password(password))
+        
+        threading.Thread(target=run, daemon=True).start()
     
     def set_password(self, password: str):
         """Đặt password và tạo encryption key"""
         try:
             # Derive key from password
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=self.salt,
-                iterations=100000,
-            )
-            key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+            kdf_params = self.kdf_params
+            key = _derive_key(self.salt, password.encode(), kdf_params)
+            
+            stored = self._read_stored_key()
+            if stored is not None and hmac.compare_digest(stored, key):
+                # Cùng password với key đã lưu: giữ nguyên key và KDF để dữ liệu cũ vẫn giải mã được
+                self._set_key(key)
+                print("✅ Encryption password set")
+                return True
+            
+            if kdf_params != _SCRYPT_PARAMS:
+                # Password mới tạo key mới: chuyển sang scrypt
+                kdf_params = dict(_SCRYPT_PARAMS)
+                key = _derive_key(self.salt, password.encode(), kdf_params)
             
             # Initialize Fernet
-            self.fernet = Fernet(key)
+            self._set_key(key)
             
-            # Save encrypted key file
-            with open(self.key_file, 'wb') as f:
-                f.write(key)
+            # Ghi kdf.json trước key file; crash giữa hai lần ghi được
+            # load_encryption_key phát hiện và sửa lại
+            _write_atomic(self.kdf_file, _json_dumps(kdf_params))
+            _write_atomic(self.key_file, key)
+            self.kdf_params = kdf_params
             
             print("✅ Encryption password set")
             return True
@@ -73,48 +310,106 @@ class EncryptionManager:
         """Load encryption key với password"""
         try:
             # Derive key from password
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=self.salt,
-                iterations=100000,
-            )
-            key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-            
-            # Test if key works
-            self.fernet = Fernet(key)
+            key = self._derive(password)
             
-            # Test encryption/decryption
-            test_data = b"test"
-            encrypted = self.fernet.encrypt(test_data)
-            decrypted = self.fernet.decrypt(encrypted)
+            # So với key đang dùng (sau set_password) hoặc key đã lưu
+            expected = self._key
+            if expected is None:
+                expected = self._read_stored_key()
+            if expected is not None and not hmac.compare_digest(expected, key):
+                key = self._recover_kdf_params(password, expected)
+                if key is None:
+                    raise Exception("Key verification failed")
             
-            if decrypted != test_data:
-                raise Exception("Key verification failed")
+            self._set_key(key)
             
             print("✅ Encryption key loaded")
             return True
         except Exception as e:
             print(f"❌ Key loading error: {e}")
-            self.fernet = None
+            self._clear_key()
             return False
     
-    def encrypt_data(self, data: Union[str, dict, list]) -> Optional[bytes]:
-        """Encrypt dữ liệu"""
+    def _read_stored_key(self) -> Optional[bytes]:
+        """Key đã lưu trong key file (None nếu chưa có)"""
+        if not os.path.exists(self.key_file):
+            return None
+        with open(self.key_file, 'rb') as f:
+            return f.read()
+    
+    def _recover_kdf_params(self, password: str, expected: bytes) -> Optional[bytes]:
+        """Thử KDF còn lại khi kdf.json không khớp key file (crash giữa hai lần ghi)"""
+        for params in (_SCRYPT_PARAMS, _LEGACY_KDF_PARAMS):
+            if params == self.kdf_params:
+                continue
+            key = _derive_key(self.salt, password.encode(), params)
+            if hmac.compare_digest(expected, key):
+                self.kdf_params = dict(params)
+                _write_atomic(self.kdf_file, _json_dumps(self.kdf_params))
+                return key
+        return None
+    
+    def _set_key(self, key: bytes):
+        """Khởi tạo Fernet và raw keys (signing | encryption) từ key base64"""
+        self.fernet = _make_fernet(key)
+        self._key = key
+        raw_key = base64.urlsafe_b64decode(key)
+        self._signing_key = raw_key[:16]
+        self._encryption_key = _crypto().algorithms.AES(raw_key[16:])
+    
+    def _clear_key(self):
+        """Bỏ key đang giữ trong bộ nhớ"""
+        self.fernet = None
+        self._key = None
+        self._signing_key = None
+        self._encryption_key = None
+    
+    def _encrypt_raw(self, data: bytes) -> bytes:
+        """AES-CBC + HMAC như Fernet nhưng bỏ lớp base64"""
+        iv = _random_bytes(16)
+        pad = 16 - len(data) % 16  # PKCS7
+        crypto = _crypto()
+        encryptor = crypto.Cipher(self._encryption_key, crypto.modes.CBC(iv)).encryptor()
+        ciphertext = encryptor.update(data) + encryptor.update(bytes((pad,)) * pad) + encryptor.finalize()
+        
+        body = _RAW_MAGIC + struct.pack(">Q", int(time.time())) + iv + ciphertext
+        return body + hmac.new(self._signing_key, body, hashlib.sha256).digest()
+    
+    def _decrypt_raw(self, token: bytes) -> bytes:
+        """Verify HMAC rồi decrypt token raw"""
+        if len(token) < _RAW_HEADER_SIZE + _HMAC_SIZE:
+            raise ValueError("Invalid raw token")
+        
+        body, signature = token[:-_HMAC_SIZE], token[-_HMAC_SIZE:]
+        expected = hmac.new(self._signing_key, body, hashlib.sha256).digest()
+        if not hmac.compare_digest(signature, expected):
+            raise ValueError("Invalid raw token signature")
+        
+        iv = body[9:_RAW_HEADER_SIZE]
+        crypto = _crypto()
+        decryptor = crypto.Cipher(self._encryption_key, crypto.modes.CBC(bytes(iv))).decryptor()
+        padded = decryptor.update(body[_RAW_HEADER_SIZE:]) + decryptor.finalize()
+        
+        # HMAC đã verify nên padding chắc chắn hợp lệ
+        return padded[:-padded[-1]]
+    
+    def _is_raw_token(self, token: Union[bytes, str]) -> bool:
+        return not isinstance(token, str) and token[:1] == _RAW_MAGIC
+    
+    def encrypt_data(self, data: Union[str, bytes, dict, list], raw: bool = False) -> Optional[bytes]:
+        """Encrypt dữ liệu (raw=True: token nội bộ không base64)"""
         if not self.fernet:
             print("❌ Encryption not initialized")
             return None
         
         try:
-            # Convert to string if needed
-            if isinstance(data, (dict, list)):
-                data = json.dumps(data, ensure_ascii=False)
-            elif not isinstance(data, str):
-                data = str(data)
+            # Convert to bytes theo type
+            payload = _PAYLOAD_ENCODERS.get(type(data), _payload_from_other)(data)
             
             # Encrypt
-            encrypted = self.fernet.encrypt(data.encode('utf-8'))
-            return encrypted
+            if raw:
+                return self._encrypt_raw(payload)
+            return self.fernet.encrypt(payload)
         except Exception as e:
             print(f"❌ Encryption error: {e}")
             return None
@@ -126,12 +421,65 @@ class EncryptionManager:
             return None
         
         try:
-            decrypted = self.fernet.decrypt(encrypted_data)
+            if self._is_raw_token(encrypted_data):
+                decrypted = self._decrypt_raw(encrypted_data)
+            else:
+                decrypted = self.fernet.decrypt(encrypted_data)
             return decrypted.decode('utf-8')
         except Exception as e:
             print(f"❌ Decryption error: {e}")
             return None
     
+    def _stream_encrypt(self, in_path: str, out_path: str):
+        """Encrypt file theo từng chunk, bộ nhớ không phụ thuộc kích thước file"""
+        iv = _random_bytes(16)
+        crypto = _crypto()
+        encryptor = crypto.Cipher(self._encryption_key, crypto.modes.CTR(iv)).encryptor()
+        header = _STREAM_MAGIC + iv
+        mac = hmac.new(self._signing_key, header, hashlib.sha256)
+        
+        with open(in_path, 'rb') as fin, open(out_path, 'wb') as fout:
+            _advise_sequential(fin)
+            fout.write(header)
+            while chunk := fin.read(_STREAM_CHUNK_SIZE):
+                block = encryptor.update(chunk)
+                mac.update(block)
+                fout.write(block)
+            fout.write(encryptor.finalize())
+            fout.write(mac.digest())
+    
+    def _stream_decrypt(self, in_path: str, out_path: str):
+        """Decrypt file stream vào file tạm, chỉ giữ lại khi HMAC hợp lệ"""
+        remaining = os.path.getsize(in_path) - _STREAM_HEADER_SIZE - _HMAC_SIZE
+        if remaining < 0:
+            raise ValueError("Invalid encrypted stream")
+        
+        tmp_path = out_path + ".tmp"
+        try:
+            with open(in_path, 'rb') as fin, open(tmp_path, 'wb') as fout:
+                _advise_sequential(fin)
+                header = fin.read(_STREAM_HEADER_SIZE)
+                mac = hmac.new(self._signing_key, header, hashlib.sha256)
+                crypto = _crypto()
+                decryptor = crypto.Cipher(self._encryption_key, crypto.modes.CTR(header[1:])).decryptor()
+                
+                while remaining > 0:
+                    chunk = fin.read(min(_STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise ValueError("Truncated encrypted stream")
+                    remaining -= len(chunk)
+                    mac.update(chunk)
+                    fout.write(decryptor.update(chunk))
+                fout.write(decryptor.finalize())
+                
+                if not hmac.compare_digest(mac.digest(), fin.read(_HMAC_SIZE)):
+                    raise ValueError("Invalid encrypted stream signature")
+            os.replace(tmp_path, out_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
     def encrypt_file(self, file_path: str, output_path: str = None) -> Optional[str]:
         """Encrypt file"""
         if not self.fernet:
@@ -141,10 +489,14 @@ class EncryptionManager:
             if not output_path:
                 output_path = file_path + ".encrypted"
             
-            with open(file_path, 'rb') as f:
-                data = f.read()
+            # File lớn: stream theo chunk thay vì đọc cả file vào RAM
+            if os.path.getsize(file_path) > _STREAM_THRESHOLD:
+                self._stream_encrypt(file_path, output_path)
+                return output_path
             
-            encrypted_data = self.fernet.encrypt(data)
+            # Cipher đọc thẳng từ page cache qua mmap, không copy ra bytes
+            with _mapped_file(file_path) as data:
+                encrypted_data = self._encrypt_raw(data)
             
             with open(output_path, 'wb') as f:
                 f.write(encrypted_data)
@@ -163,10 +515,18 @@ class EncryptionManager:
             if not output_path:
                 output_path = encrypted_file_path.replace(".encrypted", "")
             
-            with open(encrypted_file_path, 'rb') as f:
-                encrypted_data = f.read()
+            with _mapped_file(encrypted_file_path) as encrypted_data:
+                if encrypted_data[:1] == _STREAM_MAGIC:
+                    decrypted_data = None
+                elif self._is_raw_token(encrypted_data):
+                    decrypted_data = self._decrypt_raw(encrypted_data)
+                else:
+                    # Fernet cần bytes
+                    decrypted_data = self.fernet.decrypt(bytes(encrypted_data))
             
-            decrypted_data = self.fernet.decrypt(encrypted_data)
+            if decrypted_data is None:
+                self._stream_decrypt(encrypted_file_path, output_path)
+                return output_path
             
             with open(output_path, 'wb') as f:
                 f.write(decrypted_data)
@@ -176,6 +536,59 @@ class EncryptionManager:
             print(f"❌ File decryption error: {e}")
             return None
 
+# Default permissions/roles dùng chung (read-only) cho mọi PermissionSystem
+_DEFAULT_PERMISSIONS = MappingProxyType({
+    "read_conversations": True,
+    "write_conversations": True,
+    "delete_conversations": False,
+    "access_memory": True,
+    "modify_memory": True,
+    "export_data": True,
+    "import_data": False,
+    "system_commands": False,
+    "file_operations": True,
+    "network_access": True,
+    "camera_access": False,
+    "microphone_access": False,
+    "location_access": False,
+    "calendar_access": True,
+    "mood_tracking": True,
+    "screenshot_capture": False,
+    "automation_workflows": True,
+    "ai_model_access": True,
+    "encryption_management": False
+})
+
+_DEFAULT_ROLES = MappingProxyType({
+    "basic_user": MappingProxyType({
+        "read_conversations": True,
+        "write_conversations": True,
+        "access_memory": True,
+        "file_operations": False,
+        "system_commands": False,
+        "encryption_management": False
+    }),
+    "power_user": MappingProxyType({
+        "read_conversations": True,
+        "write_conversations": True,
+        "access_memory": True,
+        "modify_memory": True,
+        "file_operations": True,
+        "export_data": True,
+        "automation_workflows": True,
+        "system_commands": False,
+        "encryption_management": False
+    }),
+    "admin": MappingProxyType(dict.fromkeys(_DEFAULT_PERMISSIONS, True))
+})
+
+# Mỗi permission mặc định một bit; permission lạ được cấp bit khi gặp lần đầu
+_PERM_BITS = MappingProxyType({name: 1 << i for i, name in enumerate(_DEFAULT_PERMISSIONS)})
+
+# Gom các lần ghi permissions trong khoảng này thành một lần ghi
+_PERMISSION_SAVE_DELAY = 2.0
+
+
 class PermissionSystem:
     """Hệ thống phân quyền"""
     
@@ -187,31 +600,21 @@ class PermissionSystem:
         self.roles_file = os.path.join(data_dir, "roles.json")
         
         # Default permissions
-        self.default_permissions = {
-            "read_conversations": True,
-            "write_conversations": True,
-            "delete_conversations": False,
-            "access_memory": True,
-            "modify_memory": True,
-            "export_data": True,
-            "import_data": False,
-            "system_commands": False,
-            "file_operations": True,
-            "network_access": True,
-            "camera_access": False,
-            "microphone_access": False,
-            "location_access": False,
-            "calendar_access": True,
-            "mood_tracking": True,
-            "screenshot_capture": False,
-            "automation_workflows": True,
-            "ai_model_access": True,
-            "encryption_management": False
-        }
+        self.default_permissions = _DEFAULT_PERMISSIONS
+        
+        # Permissions lưu dạng bitmask: bit của permission bật = đã grant
+        self._bits = dict(_PERM_BITS)
+        self._mask = 0
+        self._apply_masks(self._masks_of(self._load_permissions()))
         
-        # Load permissions
-        self.permissions = self._load_permissions()
         self.roles = self._load_roles()
+        self._role_masks = {}
+        
+        # Ghi trễ: đánh dấu dirty, timer/atexit sẽ flush
+        self._dirty = False
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+        atexit.register(self.flush)
         
         print("🛡️ Permission System initialized")
     
@@ -219,8 +622,8 @@ class PermissionSystem:
         """Load user permissions"""
         try:
             if os.path.exists(self.permissions_file):
-                with open(self.permissions_file, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
+                with open(self.permissions_file, 'rb') as f:
+                    loaded = _json_loads(f.read())
                     # Merge with defaults
                     permissions = self.default_permissions.copy()
                     permissions.update(loaded)
@@ -230,54 +633,80 @@ class PermissionSystem:
         
         return self.default_permissions.copy()
     
-    def _save_permissions(self):
-        """Save permissions"""
+    def _save_permissions(self) -> bool:
+        """Save permissions (gọi khi đang giữ _save_lock)"""
         try:
-            with open(self.permissions_file, 'w', encoding='utf-8') as f:
-                json.dump(self.permissions, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.permissions_file, _json_dumps(self.permissions))
+            return True
         except Exception as e:
             print(f"❌ Error saving permissions: {e}")
+            return False
     
     def _load_roles(self) -> Dict[str, Dict[str, bool]]:
         """Load role definitions"""
-        default_roles = {
-            "basic_user": {
-                "read_conversations": True,
-                "write_conversations": True,
-                "access_memory": True,
-                "file_operations": False,
-                "system_commands": False,
-                "encryption_management": False
-            },
-            "power_user": {
-                "read_conversations": True,
-                "write_conversations": True,
-                "access_memory": True,
-                "modify_memory": True,
-                "file_operations": True,
-                "export_data": True,
-                "automation_workflows": True,
-                "system_commands": False,
-                "encryption_management": False
-            },
-            "admin": {
-                **{k: True for k in self.default_permissions.keys()}
-            }
-        }
+        default_roles = dict(_DEFAULT_ROLES)
         
         try:
             if os.path.exists(self.roles_file):
-                with open(self.roles_file, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
+                with open(self.roles_file, 'rb') as f:
+                    loaded = _json_loads(f.read())
                     default_roles.update(loaded)
         except Exception as e:
             print(f"❌ Error loading roles: {e}")
         
         return default_roles
     
+    @property
+    def permissions(self) -> Dict[str, bool]:
+        """Permissions dạng dict name -> granted (tạo từ bitmask)"""
+        mask = self._mask
+        return {name: bool(mask & bit) for name, bit in self._bits.items()}
+    
+    def _bit(self, permission: str) -> int:
+        bit = self._bits.get(permission)
+        if bit is None:
+            bit = 1 << len(self._bits)
+            self._bits[permission] = bit
+        return bit
+    
+    def _masks_of(self, permissions: Dict[str, bool]) -> tuple:
+        """(grant_mask, revoke_mask) cho dict permissions"""
+        grant = revoke = 0
+        for name, granted in permissions.items():
+            if granted:
+                grant |= self._bit(name)
+            else:
+                revoke |= self._bit(name)
+        return grant, revoke
+    
+    def _apply_masks(self, masks: tuple):
+        grant, revoke = masks
+        self._mask = (self._mask & ~revoke) | grant
+    
+    def _mark_dirty(self):
+        """Lên lịch ghi permissions sau _PERMISSION_SAVE_DELAY giây"""
+        with self._save_lock:
+            self._dirty = True
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(_PERMISSION_SAVE_DELAY, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+    
+    def flush(self):
+        """Ghi permissions nếu có thay đổi chưa lưu"""
+        with self._save_lock:
+            timer, self._save_timer = self._save_timer, None
+            if timer:
+                timer.cancel()
+            if not self._dirty:
+                return
+            # Serialize + ghi trong lock để các flush không chồng nhau
+            self._dirty = not self._save_permissions()
+    
     def check_permission(self, permission: str) -> bool:
         """Kiểm tra permission"""
-        return self.permissions.get(permission, False)
+        bit = self._bits.get(permission)
+        return bit is not None and bool(self._mask & bit)
     
     def request_permission(self, permission: str, reason: str = "") -> bool:
         """Request permission từ user"""
@@ -293,8 +722,8 @@ class PermissionSystem:
         granted = response == 'y'
         
         if granted:
-            self.permissions[permission] = True
-            self._save_permissions()
+            self._mask |= self._bit(permission)
+            self._mark_dirty()
             print(f"✅ Permission '{permission}' granted")
         else:
             print(f"❌ Permission '{permission}' denied")
@@ -303,8 +732,8 @@ class PermissionSystem:
     
     def set_permissions(self, permissions: Dict[str, bool]):
         """Set multiple permissions"""
-        self.permissions.update(permissions)
-        self._save_permissions()
+        self._apply_masks(self._masks_of(permissions))
+        self._mark_dirty()
         print("🛡️ Permissions updated")
     
     def apply_role(self, role_name: str) -> bool:
@@ -313,17 +742,20 @@ class PermissionSystem:
             print(f"❌ Role '{role_name}' not found")
             return False
         
-        role_permissions = self.roles[role_name]
-        self.permissions.update(role_permissions)
-        self._save_permissions()
+        # Masks của role chỉ tính một lần
+        masks = self._role_masks.get(role_name)
+        if masks is None:
+            masks = self._role_masks[role_name] = self._masks_of(self.roles[role_name])
+        self._apply_masks(masks)
+        self._mark_dirty()
         
         print(f"✅ Role '{role_name}' applied")
         return True
     
     def get_permission_summary(self) -> Dict[str, Any]:
         """Lấy tóm tắt permissions"""
-        granted_count = sum(1 for v in self.permissions.values() if v)
-        total_count = len(self.permissions)
+        granted_count = self._mask.bit_count()
+        total_count = len(self._bits)
         
         return {
             "granted_permissions": granted_count,
@@ -333,6 +765,48 @@ class PermissionSystem:
             "available_roles": list(self.roles.keys())
         }
 
+# Audit log xoay vòng khi vượt _AUDIT_MAX_BYTES, giữ _AUDIT_BACKUP_COUNT file cũ
+_AUDIT_MAX_BYTES = 4 * 1024 * 1024
+_AUDIT_BACKUP_COUNT = 1
+
+# Queue audit entries chờ ghi; writer gom tối đa _AUDIT_BATCH_SIZE entries/lần ghi
+_AUDIT_QUEUE_SIZE = 10000
+_AUDIT_BATCH_SIZE = 256
+
+
+_TS_NS_RE = re.compile(rb'"ts_ns":\s*(\d+)')
+
+
+def _index_lines(lines, offset: int = 0) -> List[tuple]:
+    """(ts_ns, byte offset) cho từng dòng của audit log bắt đầu tại offset"""
+    index = []
+    for line in lines:
+        match = _TS_NS_RE.search(line)
+        if match:
+            ts_ns = int(match.group(1))
+        else:
+            # Entry cũ dùng ISO timestamp hoặc dòng hỏng
+            try:
+                ts_ns = _entry_ts_ns(_json_loads(line))
+            except Exception:
+                ts_ns = 0
+        index.append((ts_ns, offset))
+        offset += len(line)
+    return index
+
+
+# Levels được in ra console ngoài việc ghi log
+_ALERT_LEVELS = frozenset(("SECURITY", "CRITICAL", "ERROR"))
+
+
+def _entry_ts_ns(log: Dict[str, Any]) -> int:
+    """Thời điểm của audit entry (ns), hỗ trợ entry cũ dùng ISO timestamp"""
+    ts_ns = log.get("ts_ns")
+    if ts_ns is None:
+        ts_ns = int(datetime.fromisoformat(log["timestamp"]).timestamp() * 1e9)
+    return ts_ns
+
+
 class AuditLogger:
     """Audit logging system"""
     
@@ -340,8 +814,23 @@ class AuditLogger:
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
         
-        self.audit_file = os.path.join(data_dir, "audit_log.json")
-        self.session_id = secrets.token_hex(8)
+        # Append-only JSON lines: mỗi event một dòng
+        self.audit_file = os.path.join(data_dir, "audit_log.jsonl")
+        self.legacy_audit_file = os.path.join(data_dir, "audit_log.json")
+        self.backup_audit_file = self.audit_file + ".1"
+        self.session_id = _random_bytes(8).hex()
+        
+        self._migrate_legacy_log()
+        
+        # Index (ts_ns, byte offset) theo thứ tự ghi để bisect theo thời gian
+        self._offsets, self._file_end = self._build_offset_index()
+        self._fh = open(self.audit_file, 'ab', buffering=0)
+        self._write_lock = threading.Lock()
+        
+        # Ghi log ở background thread, log_event chỉ put vào queue
+        self._queue = queue.Queue(maxsize=_AUDIT_QUEUE_SIZE)
+        threading.Thread(target=self._drain, daemon=True).start()
+        atexit.register(self.flush)
         
         # Log levels
         self.LOG_LEVELS = {
@@ -357,41 +846,118 @@ class AuditLogger:
         
         print("📝 Audit Logger initialized")
     
+    def _migrate_legacy_log(self):
+        """Chuyển audit_log.json cũ sang JSONL (một lần)"""
+        if os.path.exists(self.audit_file) or not os.path.exists(self.legacy_audit_file):
+            return
+        try:
+            with open(self.legacy_audit_file, 'rb') as f:
+                logs = _json_loads(f.read())
+            _write_atomic(self.audit_file, b''.join(
+                _json_dumps_line(log) for log in logs
+            ))
+            os.remove(self.legacy_audit_file)
+        except Exception as e:
+            print(f"❌ Audit log migration error: {e}")
+    
+    def _build_offset_index(self) -> tuple:
+        """Quét audit log một lần: (index, kích thước file)"""
+        try:
+            with open(self.audit_file, 'rb') as f:
+                index = _index_lines(f)
+                return index, f.tell()
+        except FileNotFoundError:
+            return [], 0
+    
+    def _rotate(self):
+        """Xoay vòng audit log: file hiện tại thành backup, mở file mới"""
+        self._fh.close()
+        try:
+            os.replace(self.audit_file, self.backup_audit_file)
+            self._offsets = []
+            self._file_end = 0
+        finally:
+            self._fh = open(self.audit_file, 'ab', buffering=0)
+    
+    def _read_logs(self, offset: int = 0, path: Optional[str] = None):
+        """Đọc từng entry trong audit log từ offset, bỏ qua dòng hỏng"""
+        path = path or self.audit_file
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    yield _json_loads(line)
+                except ValueError:
+                    continue
+    
+    def _write_entries(self, entries: List[Dict[str, Any]]):
+        """Ghi các entries bằng một lần write, xoay vòng khi file quá lớn"""
+        lines = []
+        timestamps = []
+        for entry in entries:
+            try:
+                lines.append(_json_dumps_line(entry))
+                timestamps.append(entry["ts_ns"])
+            except Exception as e:
+                print(f"❌ Audit logging error: {e}")
+        
+        with self._write_lock:
+            self._fh.write(b''.join(lines))
+            offset = self._file_end
+            for ts_ns, line in zip(timestamps, lines):
+                self._offsets.append((ts_ns, offset))
+                offset += len(line)
+            self._file_end = offset
+            if offset >= _AUDIT_MAX_BYTES:
+                self._rotate()
+    
+    def _drain(self):
+        """Writer thread: lấy entries từ queue và ghi theo batch"""
+        q = self._queue
+        while True:
+            entries = [q.get()]
+            while len(entries) < _AUDIT_BATCH_SIZE:
+                try:
+                    entries.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write_entries(entries)
+            except Exception as e:
+                print(f"❌ Audit logging error: {e}")
+            finally:
+                for _ in entries:
+                    q.task_done()
+    
+    def flush(self):
+        """Chờ tới khi mọi entries trong queue đã được ghi"""
+        self._queue.join()
+    
     def log_event(self, event_type: str, level: str, details: Dict[str, Any] = None):
         """Log audit event"""
         try:
+            level = level.upper()
             log_entry = {
-                "timestamp": datetime.now().isoformat(),
+                "ts_ns": time.time_ns(),
                 "session_id": self.session_id,
                 "event_type": event_type,
-                "level": level.upper(),
+                "level": level,
                 "details": details or {},
                 "source": "ai_assistant"
             }
             
-            # Load existing logs
-            logs = []
-            if os.path.exists(self.audit_file):
-                try:
-                    with open(self.audit_file, 'r', encoding='utf-8') as f:
-                        logs = json.load(f)
-                except:
-                    logs = []
-            
-            # Add new log
-            logs.append(log_entry)
-            
-            # Keep only last 10000 logs
-            if len(logs) > 10000:
-                logs = logs[-10000:]
-            
-            # Save logs
-            with open(self.audit_file, 'w', encoding='utf-8') as f:
-                json.dump(logs, f, ensure_ascii=False, indent=2)
+            try:
+                self._queue.put_nowait(log_entry)
+            except queue.Full:
+                # Writer không theo kịp: ghi trực tiếp
+                self._write_entries([log_entry])
             
             # Print security/critical events
-            if level.upper() in ["SECURITY", "CRITICAL", "ERROR"]:
-                print(f"🚨 {level.upper()}: {event_type} - {details}")
+            if level in _ALERT_LEVELS:
+                print(f"🚨 {level}: {event_type} - {details}")
                 
         except Exception as e:
             print(f"❌ Audit logging error: {e}")
@@ -431,20 +997,31 @@ class AuditLogger:
     def get_audit_summary(self, hours: int = 24) -> Dict[str, Any]:
         """Lấy audit summary"""
         try:
-            cutoff_time = datetime.now() - timedelta(hours=hours)
+            self.flush()
+            cutoff_ns = time.time_ns() - hours * 3600 * 10 ** 9
+            
+            # Bỏ qua phần log cũ hơn cutoff bằng binary search trên index
+            with self._write_lock:
+                i = bisect.bisect_left(self._offsets, (cutoff_ns,))
+                if i == len(self._offsets):
+                    start = None
+                else:
+                    start = self._offsets[i][1]
+            
+            # Cutoff trước entry đầu của file hiện tại: đọc thêm file backup
+            sources = []
+            if i == 0:
+                sources.append(self._read_logs(path=self.backup_audit_file))
+            if start is not None:
+                sources.append(self._read_logs(start))
             
             logs = []
-            if os.path.exists(self.audit_file):
-                with open(self.audit_file, 'r', encoding='utf-8') as f:
-                    all_logs = json.load(f)
-                    
-                    for log in all_logs:
-                        try:
-                            log_time = datetime.fromisoformat(log["timestamp"])
-                            if log_time >= cutoff_time:
-                                logs.append(log)
-                        except:
-                            continue
+            for log in itertools.chain.from_iterable(sources):
+                try:
+                    if _entry_ts_ns(log) >= cutoff_ns:
+                        logs.append(log)
+                except:
+                    continue
             
             # Analyze logs
             event_counts = {}
@@ -502,8 +1079,8 @@ class SecurityManager:
         
         try:
             if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
+                with open(self.settings_file, 'rb') as f:
+                    loaded = _json_loads(f.read())
                     default_settings.update(loaded)
         except Exception as e:
             print(f"❌ Error loading security settings: {e}")
@@ -513,8 +1090,7 @@ class SecurityManager:
     def _save_security_settings(self):
         """Save security settings"""
         try:
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.settings_file, _json_dumps(self.settings))
         except Exception as e:
             print(f"❌ Error saving security settings: {e}")
     
@@ -530,8 +1106,11 @@ class SecurityManager:
     def secure_operation(self, operation_name: str, permission_required: str, 
                         operation_func, *args, **kwargs):
         """Thực hiện operation với security checks"""
+        audit = self.audit
+        resource = kwargs.get("resource", "")
+        
         # Log the attempt
-        self.audit.log_user_action(operation_name, kwargs.get("resource", ""))
+        audit.log_user_action(operation_name, resource)
         
         # Check permission
         if not self.permissions.check_permission(permission_required):
@@ -541,22 +1120,22 @@ class SecurityManager:
                     f"Required for {operation_name}"
                 )
                 if not granted:
-                    self.audit.log_permission_check(permission_required, False, "user_denied")
+                    audit.log_permission_check(permission_required, False, "user_denied")
                     raise PermissionError(f"Permission denied: {permission_required}")
             else:
-                self.audit.log_permission_check(permission_required, False, "not_granted")
+                audit.log_permission_check(permission_required, False, "not_granted")
                 raise PermissionError(f"Permission not granted: {permission_required}")
         
-        self.audit.log_permission_check(permission_required, True)
+        audit.log_permission_check(permission_required, True)
         
         try:
             # Execute operation
             result = operation_func(*args, **kwargs)
-            self.audit.log_user_action(operation_name, kwargs.get("resource", ""), "success")
+            audit.log_user_action(operation_name, resource, "success")
             return result
         except Exception as e:
-            self.audit.log_user_action(operation_name, kwargs.get("resource", ""), "failed")
-            self.audit.log_event("OPERATION_FAILED", "error", {
+            audit.log_user_action(operation_name, resource, "failed")
+            audit.log_event("OPERATION_FAILED", "error", {
                 "operation": operation_name,
                 "error": str(e)
             })
@@ -567,7 +1146,7 @@ class SecurityManager:
         if not self.settings["encryption_enabled"]:
             return None
         
-        encrypted = self.encryption.encrypt_data(data)
+        encrypted = self.encryption.encrypt_data(data, raw=True)
         if encrypted:
             self.audit.log_data_access(data_type, "encrypt", True)
         else:
@@ -588,6 +1167,11 @@ class SecurityManager:
         
         return decrypted
     
+    def flush(self):
+        """Ghi các thay đổi còn pending (gọi khi shutdown)"""
+        self.permissions.flush()
+        self.audit.flush()
+    
     def get_security_status(self) -> Dict[str, Any]:
         """Lấy security status"""
         audit_summary = self.audit.get_audit_summary(24)
@@ -2,20 +2,125 @@
 Tools để tương tác với máy tính
 """
 import os
+import io
+import errno
+import re
+import mmap
+import codecs
 import subprocess
 import shutil
 import glob
+import fnmatch
+import itertools
+import contextlib
 import psutil
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Any, Optional
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# Kích thước mỗi lần đọc file
+_READ_CHUNK_SIZE = 128 * 1024
+# Buffer ghi file, giảm số lần gọi write() khi nội dung lớn
+_WRITE_BUFFER_SIZE = 2 * 1024 * 1024
+# Số kết quả tối đa của search_files
+_SEARCH_LIMIT = 20
+# Số threads quét nội dung file và số file giao cho pool mỗi đợt
+_SEARCH_WORKERS = 8
+_SEARCH_BATCH_SIZE = 32
+# Buffer copy qua userspace khi không dùng được copy_file_range
+_COPY_BUFFER_SIZE = 1024 * 1024
+# Lỗi copy_file_range khi kernel/filesystem không hỗ trợ (vd. khác filesystem)
+_COPY_FALLBACK_ERRNOS = frozenset((errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM))
+
+
+def _copy_file(src: str, dst: str) -> str:
+    """Copy nội dung + metadata như shutil.copy2, copy trong kernel bằng copy_file_range khi có thể"""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if not hasattr(os, 'copy_file_range'):
+        return shutil.copy2(src, dst)
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                copied = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), size - offset,
+                    offset_src=offset, offset_dst=offset
+                )
+                if not copied:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+        
+        # Phần còn lại (hoặc cả file nếu không hỗ trợ) copy qua userspace
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        shutil.copyfileobj(fsrc, fdst, length=_COPY_BUFFER_SIZE)
+    
+    shutil.copystat(src, dst)
+    return dst
+
+
+def _walk(root: str):
+    """Duyệt đệ quy thư mục bằng os.scandir, yield từng DirEntry"""
+    pending = deque([root])
+    while pending:
+        try:
+            with os.scandir(pending.popleft()) as it:
+                for entry in it:
+                    yield entry
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+        except OSError:
+            continue
+
+
+def _scan_one(path: str, needle: bytes, pattern: Optional[re.Pattern], query_lower: str) -> bool:
+    """True nếu nội dung file text chứa query (không phân biệt hoa thường)"""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return not needle
+            # Tìm trực tiếp trên bytes qua mmap, không decode cả file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm.find(needle) != -1:
+                    return True
+                if pattern is not None:
+                    return pattern.search(mm) is not None
+                # Query non-ASCII: cần decode để so sánh không phân biệt hoa thường
+                return query_lower in str(mm, 'utf-8').lower()
+    except Exception:
+        return False
 
 class ComputerTools:
     """Class chứa các tools tương tác với máy tính"""
     
     def __init__(self):
         self.safe_mode = True  # Chế độ an toàn, hỏi trước khi thực hiện
+        # Mẫu CPU đầu tiên để cpu_percent(interval=None) có mốc so sánh
+        psutil.cpu_percent(interval=None)
+        
+        # Session dùng chung để giữ kết nối keep-alive giữa các lần gọi API
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
     
     def execute_command(self, command: str, confirm: bool = True) -> Dict[str, Any]:
         """Thực hiện lệnh hệ thống"""
@@ -57,15 +162,36 @@ class ComputerTools:
                 }
             
             files = []
-            for item in path_obj.glob(pattern):
-                stat = item.stat()
-                files.append({
-                    "name": item.name,
-                    "path": str(item),
-                    "is_dir": item.is_dir(),
-                    "size": stat.st_size,
-                    "modified": stat.st_mtime
-                })
+            recursive = pattern.startswith("**/")
+            name_pattern = pattern[3:] if recursive else pattern
+            if os.sep in name_pattern or "/" in name_pattern or "**" in name_pattern:
+                # Pattern nhiều cấp thư mục: dùng pathlib glob
+                for item in path_obj.glob(pattern):
+                    stat = item.stat()
+                    files.append({
+                        "name": item.name,
+                        "path": str(item),
+                        "is_dir": item.is_dir(),
+                        "size": stat.st_size,
+                        "modified": stat.st_mtime
+                    })
+            else:
+                # DirEntry lấy tên và loại entry từ chính lần đọc thư mục
+                root = str(path_obj)
+                strip = len(os.curdir + os.sep) if root == os.curdir else 0
+                # closing() đóng scandir iterator / generator kể cả khi lỗi giữa chừng
+                with contextlib.closing(_walk(root) if recursive else os.scandir(root)) as entries:
+                    for entry in entries:
+                        if not fnmatch.fnmatch(entry.name, name_pattern):
+                            continue
+                        stat = entry.stat()
+                        files.append({
+                            "name": entry.name,
+                            "path": entry.path[strip:],
+                            "is_dir": entry.is_dir(),
+                            "size": stat.st_size,
+                            "modified": stat.st_mtime
+                        })
             
             sorted_files = sorted(files, key=lambda x: (not x["is_dir"], x["name"]))
             
@@ -100,7 +226,7 @@ class ComputerTools:
                 if choice != 'y':
                     return {"success": False, "message": "Đã hủy"}
             
-            shutil.copy2(src, dst)
+            _copy_file(src, dst)
             return {"success": True, "message": f"Đã copy {src} -> {dst}"}
         except Exception as e:
             return {"success": False, "message": str(e)}
@@ -141,14 +267,27 @@ class ComputerTools:
     def read_file(self, path: str, encoding: str = "utf-8") -> Dict[str, Any]:
         """Đọc file"""
         try:
-            with open(path, 'r', encoding=encoding) as f:
-                content = f.read()
+            # Đọc theo chunk, decode và đếm dòng trong cùng một lượt
+            decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder(encoding)(), translate=True
+            )
+            parts = []
+            lines = 1
+            with open(path, 'rb', buffering=_READ_CHUNK_SIZE) as f:
+                while chunk := f.read(_READ_CHUNK_SIZE):
+                    text = decoder.decode(chunk)
+                    lines += text.count('\n')
+                    parts.append(text)
+            text = decoder.decode(b'', final=True)
+            lines += text.count('\n')
+            parts.append(text)
+            content = ''.join(parts)
             
             return {
                 "success": True, 
                 "content": content,
                 "size": len(content),
-                "lines": content.count('\n') + 1
+                "lines": lines
             }
         except Exception as e:
             return {"success": False, "message": str(e)}
@@ -160,7 +299,6 @@ class ComputerTools:
             path = path.strip().replace('"', '').replace("'", "")
             
             # Check for invalid characters in filename
-            import re
             if re.search(r'[<>:"|?*]', Path(path).name):
                 return {"success": False, "message": f"Tên file chứa ký tự không hợp lệ: {Path(path).name}"}
             
@@ -178,9 +316,17 @@ class ComputerTools:
             if not content:
                 content = self._generate_default_content(path)
             
-            # Create the file
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            # Create the file: encode một lần, ghi thẳng vào fd (O_EXCL tránh ghi đè)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            except FileExistsError:
+                return {"success": False, "message": f"File {path} đã tồn tại"}
+            try:
+                data = memoryview(content.encode('utf-8'))
+                while data:
+                    data = data[os.write(fd, data):]
+            finally:
+                os.close(fd)
             
             return {
                 "success": True, 
@@ -284,7 +430,7 @@ This is a sample file. You can edit this content as needed.
                 if choice != 'y':
                     return {"success": False, "message": "Đã hủy"}
             
-            with open(path, 'w', encoding=encoding) as f:
+            with open(path, 'w', encoding=encoding, buffering=_WRITE_BUFFER_SIZE) as f:
                 f.write(content)
             
             return {"success": True, "message": f"Đã ghi file: {path}"}
@@ -292,51 +438,72 @@ This is a sample file. You can edit this content as needed.
             return {"success": False, "message": str(e)}
     
     def search_files(self, query: str, path: str = ".", file_pattern: str = "*") -> List[Dict[str, Any]]:
-        """Tìm kiếm files theo tên hoặc nội dung"""
-        results = []
-        
+        """Tìm kiếm files theo tên hoặc nội dung (một lượt duyệt, quét nội dung song song trong threads)"""
         try:
-            # Tìm theo tên file
-            for file_path in Path(path).rglob(file_pattern):
-                if query.lower() in file_path.name.lower():
+            query_lower = query.lower()
+            needle = query_lower.encode('utf-8')
+            pattern = re.compile(re.escape(needle), re.IGNORECASE) if query_lower.isascii() else None
+            results = []
+            
+            root = str(Path(path))
+            strip = len(os.curdir + os.sep) if root == os.curdir else 0
+            paths = []
+            for entry in _walk(root):
+                name = entry.name
+                # Tìm theo tên file
+                if query_lower in name.lower() and fnmatch.fnmatch(name, file_pattern):
                     results.append({
                         "type": "filename",
-                        "path": str(file_path),
-                        "match": file_path.name
+                        "path": entry.path[strip:],
+                        "match": name
                     })
+                    if len(results) >= _SEARCH_LIMIT:
+                        return results
+                # Gom file text để tìm trong nội dung
+                if name.endswith(".txt") and entry.is_file():
+                    paths.append(entry.path[strip:])
             
-            # Tìm trong nội dung file text
-            for file_path in Path(path).rglob("*.txt"):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        if query.lower() in content.lower():
-                            results.append({
-                                "type": "content",
-                                "path": str(file_path),
-                                "match": f"Found in content"
-                            })
-                except:
-                    continue
+            # Tìm trong nội dung file text: giao từng đợt cho pool, giữ thứ tự duyệt,
+            # dừng khi đủ số kết quả
+            executor = ThreadPoolExecutor(max_workers=_SEARCH_WORKERS)
+            try:
+                for start in range(0, len(paths), _SEARCH_BATCH_SIZE):
+                    batch = paths[start:start + _SEARCH_BATCH_SIZE]
+                    found = executor.map(_scan_one, batch, itertools.repeat(needle),
+                                         itertools.repeat(pattern), itertools.repeat(query_lower))
+                    for file_path, matched in zip(batch, found):
+                        if not matched:
+                            continue
+                        results.append({
+                            "type": "content",
+                            "path": file_path,
+                            "match": f"Found in content"
+                        })
+                        if len(results) >= _SEARCH_LIMIT:
+                            return results
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
             
-            return results[:20]  # Giới hạn 20 kết quả
+            return results
         except Exception as e:
             return [{"error": str(e)}]
     
     def get_system_info(self) -> Dict[str, Any]:
-        """Lấy thông tin hệ thống"""
+        """Lấy thông tin hệ thống (cpu_percent tính từ lần gọi trước, có thể là 0.0 nếu gọi ngay sau khi khởi tạo)"""
         try:
+            memory = psutil.virtual_memory()
+            disk = psutil.disk_usage('/')
             return {
-                "cpu_percent": psutil.cpu_percent(interval=1),
+                "cpu_percent": psutil.cpu_percent(interval=None),
                 "memory": {
-                    "total": psutil.virtual_memory().total,
-                    "available": psutil.virtual_memory().available,
-                    "percent": psutil.virtual_memory().percent
+                    "total": memory.total,
+                    "available": memory.available,
+                    "percent": memory.percent
                 },
                 "disk": {
-                    "total": psutil.disk_usage('/').total,
-                    "free": psutil.disk_usage('/').free,
-                    "percent": psutil.disk_usage('/').percent
+                    "total": disk.total,
+                    "free": disk.free,
+                    "percent": disk.percent
                 },
                 "processes": len(psutil.pids())
             }
@@ -363,11 +530,25 @@ This is a sample file. You can edit this content as needed.
         try:
             # Sử dụng free weather API
             url = f"http://wttr.in/{city}?format=j1"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                current = data['current_condition'][0]
+            with self._session.get(url, timeout=10, stream=True) as response:
+                if response.status_code != 200:
+                    return {"success": False, "message": "Không thể lấy thông tin thời tiết"}
+                
+                if IJSON_AVAILABLE:
+                    # Chỉ parse tới current_condition đầu tiên; phần còn lại đọc bỏ
+                    # (không parse) để connection được trả về pool của session
+                    items = ijson.sendable_list()
+                    parser = ijson.items_coro(items, 'current_condition.item')
+                    current = None
+                    for chunk in response.iter_content(chunk_size=_READ_CHUNK_SIZE):
+                        if current is None:
+                            parser.send(chunk)
+                            if items:
+                                current = items[0]
+                    if current is None:
+                        return {"success": False, "message": "Không thể lấy thông tin thời tiết"}
+                else:
+                    current = response.json()['current_condition'][0]
                 
                 return {
                     "success": True,
@@ -377,8 +558,6 @@ This is a sample file. You can edit this content as needed.
                     "humidity": current['humidity'],
                     "wind_speed": current['windspeedKmph']
                 }
-            else:
-                return {"success": False, "message": "Không thể lấy thông tin thời tiết"}
                 
         except Exception as e:
             return {"success": False, "message": str(e)}
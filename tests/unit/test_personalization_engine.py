@@ -0,0 +1,177 @@
+"""
+Unit tests cho ml.personalization_engine
+"""
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'src'))
+
+from ml.personalization_engine import (
+    NUMBA_AVAILABLE, PersonalizationEngine, ReinforcementLearningSystem,
+    _td_update_loop, _td_update_vectorized
+)
+
+NOW = datetime(2024, 1, 1, 10, 0)
+CONTEXT = {"user_input": "hello", "sentiment": {"overall_sentiment": "neutral"}}
+
+
+def _sequential_q(q0: float, rewards, learning_rate: float) -> float:
+    """Q sau khi áp dụng từng update theo thứ tự"""
+    q = q0
+    for reward in rewards:
+        q += learning_rate * (reward - q)
+    return q
+
+
+def _give_feedback(rl: ReinforcementLearningSystem, ratings, action: str = "concise_response"):
+    for rating in ratings:
+        rl.learn_from_feedback(CONTEXT, action, rating, now=NOW)
+
+
+def test_duplicate_pairs_in_batch_apply_sequentially(tmp_path):
+    rl = ReinforcementLearningSystem(str(tmp_path))
+    _give_feedback(rl, [2] * 20)
+    rl.flush()
+    
+    state = rl._extract_state_features(CONTEXT, NOW)
+    q = float(rl.q[state, rl.actions_idx["concise_response"]])
+    expected = _sequential_q(rl.initial_q, [-0.5] * 20, rl.learning_rate)
+    assert q == pytest.approx(expected, abs=1e-5)
+    assert -0.5 <= q <= rl.initial_q
+
+
+def test_mixed_rewards_match_sequential_fold(tmp_path):
+    rl = ReinforcementLearningSystem(str(tmp_path))
+    ratings = [1, 5, 2, 4, 3, 5, 1, 1, 5, 2, 4, 3, 5, 5, 1, 2]
+    _give_feedback(rl, ratings)
+    rl.flush()
+    
+    state = rl._extract_state_features(CONTEXT, NOW)
+    q = float(rl.q[state, rl.actions_idx["concise_response"]])
+    expected = _sequential_q(rl.initial_q, [(r - 3) / 2 for r in ratings], rl.learning_rate)
+    assert q == pytest.approx(expected, abs=1e-5)
+
+
+def test_replay_from_log_matches_saved_q_table(tmp_path):
+    rl = ReinforcementLearningSystem(str(tmp_path))
+    _give_feedback(rl, [2] * 20)
+    _give_feedback(rl, [5, 4, 5], action="detailed_response")
+    rl.flush()
+    saved_q = rl.q.copy()
+    
+    os.remove(rl.model_file)
+    replayed = ReinforcementLearningSystem(str(tmp_path))
+    assert np.allclose(replayed.q, saved_q, atol=1e-5)
+    assert replayed.q.min() >= -1.0
+
+
+def test_confidence_ignores_untried_optimistic_actions(tmp_path):
+    rl = ReinforcementLearningSystem(str(tmp_path))
+    assert rl.get_response_strategy(CONTEXT, now=NOW)["confidence"] == 0.0
+    
+    _give_feedback(rl, [1] * 20)
+    rl.flush()
+    
+    state = rl._extract_state_features(CONTEXT, NOW)
+    confidence = rl.get_response_strategy(CONTEXT, now=NOW)["confidence"]
+    assert confidence == pytest.approx(float(rl.q[state, rl.actions_idx["concise_response"]]))
+    assert confidence < 0
+
+
+def _random_batch(seed: int = 0, size: int = 500):
+    rng = np.random.default_rng(seed)
+    states = rng.integers(0, 4, size=size).astype(np.intp)
+    actions = rng.integers(0, 3, size=size).astype(np.intp)
+    rewards = rng.choice([-1.0, -0.5, 0.0, 0.5, 1.0], size=size).astype(np.float32)
+    return states, actions, rewards
+
+
+def test_vectorized_update_matches_sequential_loop():
+    states, actions, rewards = _random_batch()
+    q_loop = np.ones((8, 6), dtype=np.float32)
+    q_vec = q_loop.copy()
+    visits_loop = np.zeros((8, 6), dtype=np.int32)
+    visits_vec = visits_loop.copy()
+    
+    _td_update_loop(q_loop, visits_loop, states, actions, rewards, np.float32(0.1))
+    _td_update_vectorized(q_vec, visits_vec, states, actions, rewards, 0.1)
+    
+    assert np.allclose(q_vec, q_loop, atol=1e-5)
+    assert np.array_equal(visits_vec, visits_loop)
+
+
+@pytest.mark.skipif(not NUMBA_AVAILABLE, reason="numba không được cài")
+def test_numba_kernel_matches_vectorized_update():
+    from ml.personalization_engine import _td_update_kernel
+    
+    states, actions, rewards = _random_batch(seed=1)
+    q_kernel = np.ones((8, 6), dtype=np.float32)
+    q_vec = q_kernel.copy()
+    visits_kernel = np.zeros((8, 6), dtype=np.int32)
+    visits_vec = visits_kernel.copy()
+    
+    _td_update_kernel(q_kernel, visits_kernel, states, actions, rewards, np.float32(0.1))
+    _td_update_vectorized(q_vec, visits_vec, states, actions, rewards, 0.1)
+    
+    assert np.allclose(q_vec, q_kernel, atol=1e-5)
+    assert np.array_equal(visits_vec, visits_kernel)
+
+
+def test_feature_matrix_without_vocabulary_uses_dense_features(tmp_path):
+    engine = PersonalizationEngine(str(tmp_path))
+    training_data = [
+        {"user_input": "" if i % 2 else "the and of", "timestamp": "2024-01-01T10:00:00", "satisfaction": i % 2}
+        for i in range(12)
+    ]
+    
+    X = engine._build_feature_matrix(training_data)
+    assert X.shape == (12, 2)
+    
+    engine.train_preference_model(training_data)
+    assert engine.preference_classifier is not None
+
+
+def test_saved_preference_model_includes_fitted_vectorizer(tmp_path):
+    import gzip
+    import pickle
+    
+    engine = PersonalizationEngine(str(tmp_path))
+    training_data = [
+        {"user_input": f"python code question {i}" if i % 2 else "weather tomorrow",
+         "timestamp": "2024-01-01T10:00:00", "satisfaction": i % 2}
+        for i in range(20)
+    ]
+    engine.train_preference_model(training_data)
+    
+    with gzip.open(os.path.join(str(tmp_path), "preference_model.pkl.gz"), 'rb') as f:
+        saved = pickle.load(f)
+    
+    new_features = saved["vectorizer"].transform(["python code"])
+    assert new_features.shape[1] == len(saved["vectorizer"].vocabulary_)
+    assert saved["classifier"].n_features_in_ == 2 + new_features.shape[1]
+
+
+def test_failed_flush_keeps_sections_dirty(tmp_path, monkeypatch):
+    import ml.personalization_engine as engine_module
+    
+    engine = PersonalizationEngine(str(tmp_path))
+    engine.flush_delay = 60
+    engine.user_profile["communication_style"] = "concise"
+    engine._save_user_profile()
+    
+    def failing_dumps(obj):
+        raise RuntimeError("dictionary changed size during iteration")
+    
+    monkeypatch.setattr(engine_module, "_json_dumps", failing_dumps)
+    engine.flush()
+    assert engine._dirty == {"user_profile"}
+    
+    monkeypatch.undo()
+    engine.flush()
+    assert not engine._dirty
+    reloaded = PersonalizationEngine(str(tmp_path))
+    assert reloaded.user_profile["communication_style"] == "concise"